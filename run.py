@@ -5,10 +5,86 @@ AI狼人杀游戏主启动文件
 """
 
 import asyncio
+import difflib
 import json
-import sys
 import os
-from pathlib import Path
+import re
+import threading
+from functools import lru_cache
+
+# 可选使用orjson加速JSON解析，未安装时回退到标准库
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+DEFAULT_MODEL_NAME = "qwen3:0.6b"
+DEFAULT_OLLAMA_URL = "http://localhost:11434"
+
+# 未量化的权重精度，在纯CPU推理时内存带宽开销大
+UNQUANTIZED_LEVELS = {"F16", "BF16", "F32"}
+
+# keep_alive无法解析时刷新模型驻留的默认间隔（秒）
+KEEP_ALIVE_PING_INTERVAL = 300
+
+# Ollama时长字符串中的一段，如"1h30m"中的"1h"
+_DURATION_PART_RE = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+async def ainput(prompt: str = "") -> str:
+    """在守护线程中读取用户输入，等待期间不阻塞事件循环"""
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    
+    def resolve(setter, value):
+        if not future.done():
+            setter(value)
+    
+    def read():
+        try:
+            result = input(prompt)
+        except BaseException as e:
+            loop.call_soon_threadsafe(resolve, future.set_exception, e)
+        else:
+            loop.call_soon_threadsafe(resolve, future.set_result, result)
+    
+    threading.Thread(target=read, daemon=True).start()
+    return await future
+
+def keep_alive_seconds(keep_alive):
+    """把keep_alive配置（秒数或"30m"、"1h30m"等时长字符串）换算为秒，无法解析时返回None"""
+    if isinstance(keep_alive, (int, float)):
+        return float(keep_alive)
+    text = str(keep_alive).strip()
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    sign = -1 if text.startswith("-") else 1
+    text = text.lstrip("+-")
+    parts = _DURATION_PART_RE.findall(text)
+    if not parts or "".join(value + unit for value, unit in parts) != text:
+        return None
+    return sign * sum(float(value) * _DURATION_UNITS[unit] for value, unit in parts)
+
+def keep_alive_interval(keep_alive):
+    """刷新间隔取keep_alive时长的一半；驻留不限时（负数）或立即卸载（0）时无需刷新，返回None"""
+    seconds = keep_alive_seconds(keep_alive)
+    if seconds is None:
+        return KEEP_ALIVE_PING_INTERVAL
+    if seconds <= 0:
+        return None
+    return max(seconds / 2, 1.0)
+
+async def keep_model_alive(llm):
+    """按配置的keep_alive定期刷新，使模型在用户浏览菜单时保持驻留"""
+    interval = keep_alive_interval(llm.keep_alive)
+    if interval is None:
+        return
+    while True:
+        await asyncio.sleep(interval)
+        await llm.warm_up()
 
 def print_welcome():
     """打印欢迎信息"""
@@ -20,7 +96,61 @@ def print_welcome():
     print("🔧 支持Agent模式")
     print("=" * 60)
 
-def check_environment():
+def config_file_key(config_path: str = "config.json"):
+    """以(路径, 修改时间, 大小)标识配置文件版本，文件变化时缓存自动失效"""
+    try:
+        stat = os.stat(config_path)
+        return (config_path, stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return (config_path, None, None)
+
+@lru_cache(maxsize=4)
+def _load_config_snapshot(key):
+    """按文件版本加载并验证配置"""
+    from src.config_validator import ConfigValidator
+    return ConfigValidator(key[0]).load_config()
+
+@lru_cache(maxsize=4)
+def _validate_config_snapshot(key):
+    """按文件版本缓存游戏设置与角色分配的验证结果"""
+    from src.config_validator import ConfigValidator
+    validator = ConfigValidator(key[0])
+    config = _load_config_snapshot(key)
+    return validator.validate_game_settings(config), validator.validate_role_distribution(config)
+
+def load_validated_config(config_path: str = "config.json"):
+    """加载并验证配置（文件未变化时只解析一次）"""
+    return _load_config_snapshot(config_file_key(config_path))
+
+def load_bootstrap_state():
+    """加载启动阶段共享的配置与提示词，供各检查步骤复用"""
+    state = {
+        "config": None,
+        "role_prompts": None,
+        "ollama_url": DEFAULT_OLLAMA_URL,
+        "model_name": DEFAULT_MODEL_NAME,
+        "llm": None,
+        "http": None,
+    }
+    
+    try:
+        config = load_validated_config()
+        ai_settings = config.get("ai_settings", {})
+        state["config"] = config
+        state["ollama_url"] = ai_settings.get("ollama_base_url", DEFAULT_OLLAMA_URL)
+        state["model_name"] = ai_settings.get("model_name", DEFAULT_MODEL_NAME)
+    except Exception as e:
+        print(f"❌ 配置文件读取失败: {e}")
+    
+    try:
+        with open('prompts/role_prompts.json', 'rb') as f:
+            state["role_prompts"] = _loads(f.read())
+    except Exception as e:
+        print(f"❌ 角色提示词读取失败: {e}")
+    
+    return state
+
+def check_environment(state):
     """检查环境配置"""
     print("\n🔍 检查环境配置...")
     
@@ -31,10 +161,19 @@ def check_environment():
         'prompts/game_prompts.json',
     ]
     
-    missing_files = []
-    for file_path in required_files:
-        if not Path(file_path).exists():
-            missing_files.append(file_path)
+    # 每个目录只扫描一次，再在内存中检查文件是否存在
+    present = {}
+    for directory in {os.path.dirname(file_path) or '.' for file_path in required_files}:
+        try:
+            with os.scandir(directory) as entries:
+                present[directory] = {entry.name for entry in entries}
+        except OSError:
+            present[directory] = set()
+    
+    missing_files = [
+        file_path for file_path in required_files
+        if os.path.basename(file_path) not in present[os.path.dirname(file_path) or '.']
+    ]
     
     if missing_files:
         print("❌ 缺少以下必要文件:")
@@ -48,11 +187,13 @@ def check_environment():
     try:
         from src.config_validator import ConfigValidator
         validator = ConfigValidator()
-        config = validator.load_config()
+        config = state["config"]
+        if config is None:
+            print("❌ 配置检查失败: 配置未能加载")
+            return False
         
-        # 验证游戏设置
-        game_validation = validator.validate_game_settings(config)
-        role_validation = validator.validate_role_distribution(config)
+        # 验证游戏设置（配置文件未变化时复用上次的验证结果）
+        game_validation, role_validation = _validate_config_snapshot(config_file_key())
         
         print("\n📋 游戏配置检查:")
         
@@ -105,38 +246,52 @@ def check_environment():
         print(f"❌ 配置检查失败: {e}")
         return False
 
-def check_ollama_connection():
+async def check_ollama_connection(state):
     """检查Ollama连接"""
     print("\n🔗 检查Ollama连接...")
     
     try:
-        import requests
-        import json
+        from src.llm_interface import create_http_session, resolve_model_tag
         
-        # 从配置文件读取设置
-        try:
-            with open('config.json', 'r', encoding='utf-8') as f:
-                config = json.load(f)
-            ollama_url = config.get("ai_settings").get("ollama_base_url", "http://localhost:11434")
-            model_name = config.get("ai_settings").get("model_name")
-        except Exception as e:
-            print(f"❌ 配置文件读取失败: {e}")
-            return False
+        ollama_url = state["ollama_url"]
+        model_name = state["model_name"]
+        
+        # 健康检查与后续LLM调用共享同一个连接池
+        if state["http"] is None:
+            state["http"] = create_http_session()
+        http = state["http"]
         
-        response = requests.get(f"{ollama_url}/api/tags", timeout=5)
+        # 在线程中执行阻塞请求，模型列表与版本查询并发进行，避免阻塞事件循环
+        tags_result, version_result = await asyncio.gather(
+            asyncio.to_thread(http.get, f"{ollama_url}/api/tags", timeout=5),
+            asyncio.to_thread(http.get, f"{ollama_url}/api/version", timeout=5),
+            return_exceptions=True
+        )
+        if isinstance(tags_result, Exception):
+            raise tags_result
+        
+        response = tags_result
         if response.status_code == 200:
+            if not isinstance(version_result, Exception) and version_result.status_code == 200:
+                print(f"   Ollama版本: {version_result.json().get('version', 'unknown')}")
+            
             models = response.json().get("models", [])
             model_names = [model.get("name", "") for model in models]
             
-            # 检查是否有配置的模型
-            has_model = any(model_name in name for name in model_names)
+            # 检查是否有配置的模型（标签须完全一致，省略标签时对应latest）
+            full_name = resolve_model_tag(model_name)
+            has_model = full_name in model_names
             
             if has_model:
                 print(f"✅ Ollama连接成功，{model_name}模型可用")
+                warn_unquantized_model(models, full_name)
                 return True
             else:
                 print(f"⚠️ Ollama连接成功，但未找到{model_name}模型")
                 print("   可用模型:", model_names)
+                close_matches = difflib.get_close_matches(model_name, model_names, n=3)
+                if close_matches:
+                    print("   相近的模型:", close_matches)
                 return False
         else:
             print(f"❌ Ollama服务器响应异常: {response.status_code}")
@@ -148,21 +303,35 @@ def check_ollama_connection():
         print(f"❌ 无法连接到Ollama: {e}")
         return False
 
-def print_setup_guide():
+def warn_unquantized_model(models, model_name):
+    """所选模型为未量化版本时给出提示"""
+    for model in models:
+        name = model.get("name", "")
+        if name != model_name:
+            continue
+        quantization = model.get("details", {}).get("quantization_level", "")
+        if quantization.upper() in UNQUANTIZED_LEVELS:
+            print(f"⚠️ {name} 为未量化模型({quantization})，在仅CPU的主机上生成速度较慢")
+            print(f"   建议改用量化版本，例如: ollama pull {model_name.split(':')[0]}:<大小>-q4_K_M")
+        return
+
+async def warm_up_model(state):
+    """预加载模型到内存，避免首次调用时的冷启动延迟"""
+    llm = state["llm"]
+    if await llm.warm_up():
+        print(f"🔥 模型已预加载（保持 {llm.keep_alive}）")
+        return True
+    print("⚠️ 模型预加载失败，首次调用可能较慢")
+    return False
+
+def print_setup_guide(state):
     """打印设置指南"""
     print("\n" + "=" * 60)
     print("📋 环境设置指南")
     print("=" * 60)
     
-    # 从配置文件读取设置
-    try:
-        with open('config.json', 'r', encoding='utf-8') as f:
-            config = json.load(f)
-        model_name = config.get("ai_settings", {}).get("model_name", "qwen3:0.6b")
-        ollama_url = config.get("ai_settings", {}).get("ollama_base_url", "http://localhost:11434")
-    except:
-        model_name = "qwen3:0.6b"
-        ollama_url = "http://localhost:11434"
+    model_name = state["model_name"]
+    ollama_url = state["ollama_url"]
     
     print("\n1️⃣ 安装Python依赖包：")
     print("   pip install -r requirements.txt")
@@ -174,6 +343,8 @@ def print_setup_guide():
     
     print(f"\n3️⃣ 下载{model_name}模型：")
     print(f"   ollama pull {model_name}")
+    print("   模型标签建议：追求速度使用 :q4_K_M 量化版本，追求准确度使用 :q8_0")
+    print("   未量化的 :fp16 版本在仅CPU的主机上会明显变慢")
     
     print("\n4️⃣ 启动Ollama服务：")
     print("   ollama serve")
@@ -187,63 +358,48 @@ def print_setup_guide():
     
     print("\n" + "=" * 60)
 
-async def test_basic_ai():
+async def test_basic_ai(state):
     """测试基础AI功能"""
     print("\n🧪 进行基础AI测试...")
     
     try:
-        from src.llm_interface import LLMInterface
-        from src.config_validator import ConfigValidator
-        
-        # 使用配置验证器加载配置
-        validator = ConfigValidator()
-        config = validator.load_config()
-        
-        # 创建LLM接口
-        llm = LLMInterface(config)
-        
-        # 简单测试
-        response = await llm.generate_response(
+        # 简单测试，边生成边输出
+        print("🤖 AI回复: ", end="", flush=True)
+        async for chunk in state["llm"].stream_response(
             "请简单回复：AI狼人杀游戏测试成功！",
-            "你是一个友好的AI助手。"
-        )
+            "你是一个友好的AI助手。",
+            use_cache=True
+        ):
+            print(chunk, end="", flush=True)
+        print()
         
         print(f"✅ AI测试成功!")
-        print(f"🤖 AI回复: {response}")
         return True
         
     except Exception as e:
         print(f"❌ AI测试失败: {e}")
         return False
 
-async def start_simple_demo():
+async def start_simple_demo(state):
     """启动简单演示"""
     print("\n🎭 启动AI角色演示...")
     
     try:
-        # 添加src目录到路径
-        src_path = os.path.join(os.path.dirname(__file__), 'src')
-        if src_path not in sys.path:
-            sys.path.insert(0, src_path)
-        
-        from src.llm_interface import LLMInterface
+        config = state["config"]
+        role_prompts = state["role_prompts"]
+        if role_prompts is None:
+            raise ValueError("角色提示词未加载")
         
-        from src.config_validator import ConfigValidator
-        
-        # 使用配置验证器加载配置
-        validator = ConfigValidator()
-        config = validator.load_config()
-        
-        with open('prompts/role_prompts.json', 'r', encoding='utf-8') as f:
-            role_prompts = json.load(f)
-        
-        # 创建LLM接口和Agent工厂
-        llm = LLMInterface(config)
+        # 复用共享的LLM接口创建Agent工厂
+        llm = state["llm"]
         from src.agents.agent_factory import AgentFactory
         factory = AgentFactory(config)
         
-        # 创建村民Agent
-        villager = factory.create_agent(1, "演示村民", "villager", llm, role_prompts)
+        # 创建村民Agent，同时刷新模型预加载
+        villager, _ = await asyncio.gather(
+            asyncio.to_thread(factory.create_agent, 1, "演示村民", "villager", llm, role_prompts),
+            llm.warm_up()
+        )
         
         print(f"✅ 成功创建Agent: {villager}")
         
@@ -272,11 +428,6 @@ async def start_full_game():
     print("\n🎮 启动完整AI狼人杀游戏...")
     
     try:
-        # 添加src目录到路径
-        # src_path = os.path.join(os.path.dirname(__file__), 'src')
-        # if src_path not in sys.path:
-        #     sys.path.insert(0, src_path)
-        
         from src.werewolf_game import WerewolfGame
         
         # 创建游戏实例
@@ -288,7 +439,7 @@ async def start_full_game():
         
         # 询问是否继续
         if not all(game.validate_environment().values()):
-            response = input("\n⚠️ 检测到环境问题，是否继续启动游戏？(y/N): ").strip().lower()
+            response = (await ainput("\n⚠️ 检测到环境问题，是否继续启动游戏？(y/N): ")).strip().lower()
             if response != 'y':
                 print("游戏启动已取消")
                 return
@@ -314,7 +465,7 @@ async def start_full_game():
         print("1. 🎮 完整游戏")
         print("2. ⚡ 快速演示")
         
-        mode_choice = input("\n👉 请选择模式 (1-2): ").strip()
+        mode_choice = (await ainput("\n👉 请选择模式 (1-2): ")).strip()
         
         if mode_choice == '2':
             print("\n⚡ 启动快速演示模式...")
@@ -353,37 +504,22 @@ def show_menu():
     print("5. 🚪 退出")
     print("=" * 40)
 
-async def main():
-    """主函数"""
-    print_welcome()
-    
-    # 检查环境
-    if not check_environment():
-        print("\n❌ 环境检查失败，请完成文件配置")
-        return
-    
-    # 检查Ollama
-    ollama_ok = check_ollama_connection()
-    
-    if not ollama_ok:
-        print_setup_guide()
-        return
-    
-    # 主循环
+async def run_menu(state):
+    """运行主菜单循环"""
     while True:
         show_menu()
         
         try:
-            choice = input("\n👉 请选择操作 (1-5): ").strip()
+            choice = (await ainput("\n👉 请选择操作 (1-5): ")).strip()
             
             if choice == '1':
-                await test_basic_ai()
+                await test_basic_ai(state)
             elif choice == '2':
-                await start_simple_demo()
+                await start_simple_demo(state)
             elif choice == '3':
                 await start_full_game()
             elif choice == '4':
-                print_setup_guide()
+                print_setup_guide(state)
             elif choice == '5':
                 print("\n👋 感谢使用AI狼人杀游戏！")
                 break
@@ -396,5 +532,43 @@ async def main():
         except Exception as e:
             print(f"\n❌ 操作出错: {e}")
 
+async def main():
+    """主函数"""
+    print_welcome()
+    
+    # 启动配置只加载一次，后续步骤共享
+    state = load_bootstrap_state()
+    
+    # 检查环境
+    if not check_environment(state):
+        print("\n❌ 环境检查失败，请完成文件配置")
+        return
+    
+    try:
+        # 检查Ollama
+        ollama_ok = await check_ollama_connection(state)
+        
+        if not ollama_ok:
+            print_setup_guide(state)
+            return
+        
+        # 菜单各操作共享同一个LLM接口和HTTP连接池
+        from src.llm_interface import LLMInterface
+        state["llm"] = await asyncio.to_thread(LLMInterface, state["config"], state["http"])
+        await warm_up_model(state)
+        keep_alive_task = asyncio.create_task(keep_model_alive(state["llm"]))
+        
+        # 主循环
+        try:
+            await run_menu(state)
+        finally:
+            keep_alive_task.cancel()
+    finally:
+        if state["http"] is not None:
+            state["http"].close()
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\n\n👋 游戏已退出")
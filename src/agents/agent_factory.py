@@ -3,19 +3,30 @@ Agent工厂系统
 提供统一的Agent创建接口，只支持Agent模式
 """
 
+import asyncio
 import logging
-from typing import Dict, Any, List, Optional
+from functools import partial
+from typing import Dict, Any, List, Optional, Callable, Type
+from ..llm_interface import LLMInterface
 from .base_agent import BaseGameAgent
 from .role_agents.witch_agent import WitchAgent
 from .role_agents.seer_agent import SeerAgent
 from .role_agents.werewolf_agent import WerewolfAgent
 from .role_agents.villager_agent import VillagerAgent
 
+# 角色类型到Agent类的映射
+_AGENT_CLASSES: Dict[str, Type[BaseGameAgent]] = {
+    "witch": WitchAgent,
+    "seer": SeerAgent,
+    "werewolf": WerewolfAgent,
+    "villager": VillagerAgent,
+}
+
 
 class AgentFactory:
     """Agent工厂类"""
     
-    def __init__(self, config: Dict[str, Any]):
+    def __init__(self, config: Dict[str, Any]) -> None:
         """
         初始化Agent工厂
         
@@ -31,9 +42,9 @@ class AgentFactory:
         self.logger = logging.getLogger(__name__)
         self.logger.info("Agent工厂初始化完成")
     
-    def create_agent(self, player_id: int, name: str, role: str, llm_interface, 
+    def create_agent(self, player_id: int, name: str, role: str, llm_interface: LLMInterface, 
                     prompts: Dict[str, Any], identity_system=None, 
-                    memory_config=None):
+                    memory_config: Optional[Dict[str, Any]] = None, constructors: Optional[Dict[str, Callable]] = None) -> BaseGameAgent:
         """
         创建Agent实例
         
@@ -45,16 +56,18 @@ class AgentFactory:
             prompts: 提示词配置
             identity_system: 身份系统
             memory_config: 记忆配置
+            constructors: 预绑定公共参数的角色构造函数（批量创建时使用）
             
         Returns:
             Agent实例
         """
         try:
             return self._create_agent_mode(player_id, name, role, llm_interface, 
-                                         prompts, identity_system, memory_config)
+                                         prompts, identity_system, memory_config,
+                                         constructors)
                 
         except Exception as e:
-            self.logger.error(f"创建Agent失败: {e}")
+            self.logger.error("创建Agent失败: %s", e)
             if self.fallback_enabled:
                 self.logger.info("启用备用方案，创建基础Agent")
                 return self._create_fallback_agent(player_id, name, role, llm_interface, 
@@ -62,56 +75,70 @@ class AgentFactory:
             else:
                 raise
     
-    def _create_agent_mode(self, player_id: int, name: str, role: str, llm_interface, 
+    async def acreate_agent(self, player_id: int, name: str, role: str, llm_interface: LLMInterface, 
+                           prompts: Dict[str, Any], identity_system=None, 
+                           memory_config: Optional[Dict[str, Any]] = None, constructors: Optional[Dict[str, Callable]] = None) -> BaseGameAgent:
+        """
+        异步创建Agent实例，阻塞的构造过程在线程中执行
+        
+        Args:
+            与create_agent相同
+            
+        Returns:
+            Agent实例
+        """
+        return await asyncio.to_thread(self.create_agent, player_id, name, role, 
+                                       llm_interface, prompts, identity_system, 
+                                       memory_config, constructors)
+    
+    def _bind_constructors(self, player_configs: List[Dict[str, Any]], llm_interface: LLMInterface, 
                           prompts: Dict[str, Any], identity_system=None, 
-                          memory_config=None):
-        """创建Agent模式实例"""
-        try:
-            if role == "witch":
-                agent = WitchAgent(player_id, name, llm_interface, prompts, 
-                                 identity_system, memory_config)
-            elif role == "seer":
-                agent = SeerAgent(player_id, name, llm_interface, prompts, 
-                                identity_system, memory_config)
-            elif role == "werewolf":
-                agent = WerewolfAgent(player_id, name, llm_interface, prompts, 
-                                    identity_system, memory_config)
-            elif role == "villager":
-                agent = VillagerAgent(player_id, name, llm_interface, prompts, 
-                                    identity_system, memory_config)
-            else:
+                          memory_config: Optional[Dict[str, Any]] = None) -> Dict[str, Callable]:
+        """为本批次出现的角色预绑定公共构造参数，之后只需传入玩家ID和名称"""
+        roles = {config.get("role") for config in player_configs}
+        return {
+            role: partial(_AGENT_CLASSES[role], llm_interface=llm_interface, prompts=prompts,
+                          identity_system=identity_system, memory_config=memory_config)
+            for role in roles if role in _AGENT_CLASSES
+        }
+    
+    def _create_agent_mode(self, player_id: int, name: str, role: str, llm_interface: LLMInterface, 
+                          prompts: Dict[str, Any], identity_system=None, 
+                          memory_config: Optional[Dict[str, Any]] = None, constructors: Optional[Dict[str, Callable]] = None) -> BaseGameAgent:
+        """创建Agent模式实例，失败时由create_agent统一处理备用方案"""
+        constructor = constructors.get(role) if constructors else None
+        if constructor is not None:
+            agent = constructor(player_id, name)
+        else:
+            agent_class = _AGENT_CLASSES.get(role)
+            if agent_class is None:
                 raise ValueError(f"不支持的角色类型: {role}")
             
-            self.logger.info(f"成功创建{role} Agent: 玩家{player_id}")
-            return agent
-            
-        except Exception as e:
-            self.logger.error(f"创建Agent模式失败: {e}")
-            if self.fallback_enabled:
-                return self._create_fallback_agent(player_id, name, role, llm_interface, 
-                                                 prompts, identity_system, memory_config)
-            else:
-                raise
+            agent = agent_class(player_id, name, llm_interface, prompts, 
+                                identity_system, memory_config)
+        
+        self.logger.info("成功创建%s Agent: 玩家%s", role, player_id)
+        return agent
     
-    def _create_fallback_agent(self, player_id: int, name: str, role: str, llm_interface, 
+    def _create_fallback_agent(self, player_id: int, name: str, role: str, llm_interface: LLMInterface, 
                               prompts: Dict[str, Any], identity_system=None, 
-                              memory_config=None):
+                              memory_config: Optional[Dict[str, Any]] = None) -> BaseGameAgent:
         """创建备用Agent实例"""
         try:
             # 使用VillagerAgent作为通用备用方案
             agent = VillagerAgent(player_id, name, llm_interface, prompts, 
                                 identity_system, memory_config)
             
-            self.logger.info(f"成功创建备用{role} Agent: 玩家{player_id}")
+            self.logger.info("成功创建备用%s Agent: 玩家%s", role, player_id)
             return agent
             
         except Exception as e:
-            self.logger.error(f"创建备用Agent失败: {e}")
+            self.logger.error("创建备用Agent失败: %s", e)
             raise
     
-    def create_players(self, player_configs: List[Dict[str, Any]], llm_interface, 
+    def create_players(self, player_configs: List[Dict[str, Any]], llm_interface: LLMInterface, 
                       prompts: Dict[str, Any], identity_system=None, 
-                      memory_config=None) -> List[BaseGameAgent]:
+                      memory_config: Optional[Dict[str, Any]] = None) -> List[BaseGameAgent]:
         """
         批量创建玩家Agent
         
@@ -126,6 +153,8 @@ class AgentFactory:
             Agent列表
         """
         players = []
+        constructors = self._bind_constructors(player_configs, llm_interface, prompts, 
+                                               identity_system, memory_config)
         
         for config in player_configs:
             try:
@@ -134,15 +163,49 @@ class AgentFactory:
                 role = config["role"]
                 
                 agent = self.create_agent(player_id, name, role, llm_interface, 
-                                        prompts, identity_system, memory_config)
+                                        prompts, identity_system, memory_config,
+                                        constructors)
                 players.append(agent)
                 
             except Exception as e:
-                self.logger.error(f"创建玩家{config.get('id', 'unknown')}失败: {e}")
+                self.logger.error("创建玩家%s失败: %s", config.get('id', 'unknown'), e)
                 if not self.fallback_enabled:
                     raise
         
-        self.logger.info(f"成功创建{len(players)}个玩家Agent")
+        self.logger.info("成功创建%d个玩家Agent", len(players))
+        return players
+    
+    async def acreate_players(self, player_configs: List[Dict[str, Any]], llm_interface: LLMInterface, 
+                             prompts: Dict[str, Any], identity_system=None, 
+                             memory_config: Optional[Dict[str, Any]] = None) -> List[BaseGameAgent]:
+        """
+        并发批量创建玩家Agent，返回顺序与player_configs一致
+        
+        Args:
+            与create_players相同
+            
+        Returns:
+            Agent列表
+        """
+        constructors = self._bind_constructors(player_configs, llm_interface, prompts, 
+                                               identity_system, memory_config)
+        results = await asyncio.gather(*[
+            self.acreate_agent(config["id"], config["name"], config["role"], 
+                               llm_interface, prompts, identity_system, memory_config,
+                               constructors)
+            for config in player_configs
+        ], return_exceptions=True)
+        
+        players = []
+        for config, result in zip(player_configs, results):
+            if isinstance(result, Exception):
+                self.logger.error("创建玩家%s失败: %s", config.get('id', 'unknown'), result)
+                if not self.fallback_enabled:
+                    raise result
+                continue
+            players.append(result)
+        
+        self.logger.info("成功创建%d个玩家Agent", len(players))
         return players
     
     def get_mode_info(self) -> Dict[str, Any]:
@@ -152,7 +215,7 @@ class AgentFactory:
             "llm_backend": self.llm_backend,
             "tools_enabled": self.tools_enabled,
             "fallback_enabled": self.fallback_enabled,
-            "supported_roles": ["witch", "seer", "werewolf", "villager"]
+            "supported_roles": list(_AGENT_CLASSES)
         }
     
     def validate_config(self) -> Dict[str, Any]:
@@ -4,8 +4,15 @@
 """
 
 import asyncio
+import hashlib
+import json
 import logging
-from typing import Dict, Any, List, Optional, Callable
+import random
+import re
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Dict, Any, AsyncIterator, Deque, FrozenSet, Iterator, List, Optional, Callable, Tuple
 from abc import ABC, abstractmethod
 from datetime import datetime
 
@@ -16,6 +23,172 @@ from llama_index.llms.ollama import Ollama
 from ..ai_agent import BaseAIAgent
 from ..llm_interface import LLMInterface
 
+# 可选使用orjson进行规范化JSON序列化（键排序、紧凑格式），未安装时回退到标准库
+try:
+    import orjson
+    
+    def _canonical_json(data: Any) -> bytes:
+        return orjson.dumps(data, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS, default=str)
+    
+    _json_loads = orjson.loads
+except ImportError:
+    def _canonical_json(data: Any) -> bytes:
+        return json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(",", ":"), 
+                          default=str).encode()
+    
+    _json_loads = json.loads
+
+# 调用LLM时可能出现的错误：超时、连接失败、模型输出无法解析等，仅这些错误回退到基础决策
+try:
+    import httpx
+    _LLM_ERRORS = (asyncio.TimeoutError, ConnectionError, ValueError, httpx.HTTPError)
+except ImportError:
+    _LLM_ERRORS = (asyncio.TimeoutError, ConnectionError, ValueError)
+
+# 每个Agent最多缓存的决策数
+DECISION_CACHE_SIZE = 256
+# 决策历史保留的最大条数，以及每条记录中响应文本的最大长度
+DECISION_HISTORY_SIZE = 64
+DECISION_RESPONSE_PREVIEW = 512
+
+# 决策中的目标ID；流式读取时要求数字后已出现其他字符，避免把"12"截成"1"
+TARGET_ID_RE = re.compile(r'target_id["\']?\s*:\s*(\d+)')
+_TARGET_ID_DONE_RE = re.compile(r'target_id["\']?\s*:\s*\d+\D')
+# 增量扫描时与上次扫描位置的重叠长度，覆盖跨片段的关键字
+_STREAM_SCAN_OVERLAP = 32
+
+# 决策链中从上一步结果带入下一步上下文的字段
+_CARRY_KEYS = frozenset({"action", "target", "target_id", "success", "message", "observation"})
+
+# 写入决策提示的上下文字段；game_state已单独格式化为游戏情况，不再整体输出
+_ALLOWED_CONTEXT_KEYS = (
+    "action", "candidates", "death_info", "message", "observation", "player_id",
+    "potion_status", "role", "speech", "success", "suspicions", "target", "target_id"
+)
+
+# 按(模型, 地址, 温度)共享的Ollama客户端，所有Agent复用同一连接池
+_LLM_POOL: Dict[tuple, Ollama] = {}
+_LLM_POOL_LOCK = threading.Lock()
+
+
+def _get_shared_llm(model_name: str, base_url: str, temperature: float) -> Ollama:
+    """获取共享的Ollama客户端，不存在时创建"""
+    key = (model_name, base_url, temperature)
+    with _LLM_POOL_LOCK:
+        llm = _LLM_POOL.get(key)
+        if llm is None:
+            llm = Ollama(model=model_name, base_url=base_url, temperature=temperature,
+                         request_timeout=120.0)
+            _LLM_POOL[key] = llm
+        return llm
+
+
+def parse_json_decision(text: str) -> Optional[Dict[str, Any]]:
+    """将模型输出按JSON对象解析（容忍前后的多余文字），无法解析时返回None"""
+    start = text.find("{")
+    end = text.rfind("}")
+    if start < 0 or end < start:
+        return None
+    try:
+        data = _json_loads(text[start:end + 1])
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def extract_response_text(response: Any) -> str:
+    """取出模型回复文本：字符串原样返回，响应对象取其文本字段，避免对整个对象做str()"""
+    if isinstance(response, str):
+        return response
+    text = getattr(response, "response", None)
+    if isinstance(text, str):
+        return text
+    content = getattr(getattr(response, "message", None), "content", None)
+    if isinstance(content, str):
+        return content
+    return str(response)
+
+
+class PlayerView:
+    """玩家信息的轻量只读视图，属性访问代替逐个字典键查找"""
+    __slots__ = ("id", "name", "is_alive", "role")
+    
+    def __init__(self, player: Dict[str, Any], is_alive: Optional[bool] = None):
+        self.id = player["id"]
+        self.name = player.get("name", "")
+        self.is_alive = player.get("is_alive", True) if is_alive is None else is_alive
+        self.role = player.get("role")
+    
+    def __repr__(self) -> str:
+        return f"PlayerView(id={self.id}, name='{self.name}', is_alive={self.is_alive})"
+
+
+@dataclass(frozen=True)
+class GameStateView:
+    """game_state中玩家信息的一次性索引；同一份game_state只构建一次，供多个Agent和方法复用"""
+    alive_ids: Tuple[int, ...]      # 存活玩家ID，按ID排序
+    alive_set: FrozenSet[int]       # 存活玩家ID集合
+    alive_mask: int                 # 存活玩家位掩码（以玩家ID为位序）
+    by_id: Dict[int, PlayerView]    # 玩家ID -> 玩家视图（含存活与死亡玩家）
+
+
+def game_state_view(game_state: Dict[str, Any]) -> GameStateView:
+    """获取game_state的玩家索引视图，首次调用时构建并缓存在game_state上"""
+    view = game_state.get("_state_view")
+    if view is None:
+        alive_ids = tuple(sorted(p["id"] for p in game_state.get("alive_players", [])))
+        mask = 0
+        for player_id in alive_ids:
+            mask |= 1 << player_id
+        by_id = {p["id"]: PlayerView(p, True) for p in game_state.get("alive_players", [])}
+        by_id.update((p["id"], PlayerView(p, False)) for p in game_state.get("dead_players", []))
+        view = GameStateView(
+            alive_ids=alive_ids,
+            alive_set=frozenset(alive_ids),
+            alive_mask=mask,
+            by_id=by_id
+        )
+        game_state["_state_view"] = view
+    return view
+
+
+def _allowed_context(context: Dict[str, Any]) -> Dict[str, Any]:
+    """决策上下文中允许写入提示的字段"""
+    return {key: context[key] for key in _ALLOWED_CONTEXT_KEYS if key in context}
+
+
+def alive_id_set(game_state: Dict[str, Any]) -> FrozenSet[int]:
+    """存活玩家ID集合；在同一份game_state上只计算一次，供共享该状态的多个Agent复用"""
+    return game_state_view(game_state).alive_set
+
+
+def alive_id_mask(game_state: Dict[str, Any]) -> int:
+    """存活玩家位掩码（以玩家ID为位序）"""
+    return game_state_view(game_state).alive_mask
+
+
+def iter_bits(mask: int) -> Iterator[int]:
+    """按ID从小到大遍历位掩码中被置位的玩家ID"""
+    while mask:
+        lowest = mask & -mask
+        yield lowest.bit_length() - 1
+        mask ^= lowest
+
+
+def _game_state_fingerprint(game_state: Dict[str, Any]) -> tuple:
+    """提取影响游戏上下文文本的字段，作为格式化缓存的键"""
+    speeches = game_state.get("recent_speeches") or []
+    last_speech = speeches[-1] if speeches else {}
+    return (
+        game_state.get("current_round"),
+        game_state.get("phase"),
+        tuple(p["id"] for p in game_state.get("alive_players", [])),
+        tuple(p["id"] for p in game_state.get("dead_players", [])),
+        len(speeches),
+        last_speech.get("speaker"),
+        last_speech.get("content")
+    )
+
 
 class BaseGameAgent(BaseAIAgent):
     """基于LlamaIndex的游戏Agent基类"""
@@ -28,15 +201,29 @@ class BaseGameAgent(BaseAIAgent):
         # Agent特有属性
         self.tools: List[FunctionTool] = []
         self.agent_runner: Optional[ReActAgent] = None # 将在_initialize_agent被立刻赋值
-        self.decision_history: List[Dict[str, Any]] = []
+        self.decision_history: Deque[Dict[str, Any]] = deque(maxlen=DECISION_HISTORY_SIZE)
+        self._static_prefix_cache: Optional[str] = None
+        self._system_prompt_cache: Dict[str, str] = {}
+        self._decision_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # 每个Agent独立的随机数生成器，便于按Agent复现随机选择
+        self._rng = random.Random()
+        # 阶段内的格式化文本缓存，每个阶段开始时清空
+        self._phase_id: Optional[tuple] = None
+        self._fmt_cache: Dict[tuple, str] = {}
+        self._memory_fmt_cache: Dict[int, str] = {}  # {max_events: 记忆文本}，记忆更新时清空
+        # 尚未完成的后台记忆写入任务，阶段结束时统一等待
         
         # 注意：不在这里初始化Agent，让子类先完成工具实例化
     
     def initialize_agent(self):
-        """初始化LlamaIndex Agent"""
+        """初始化LlamaIndex Agent（重复调用不会重复注册工具）"""
+        if self.agent_runner is not None:
+            return
         try:
-            # 注册工具
+            # 注册工具，并按名称排序使工具列表在提示中保持稳定
             self.register_tools()
+            self.tools.sort(key=self._tool_name)
+            self._static_prefix_cache = None
             
             # 创建Agent Runner
             self.agent_runner = self._create_agent_runner()
@@ -57,12 +244,14 @@ class BaseGameAgent(BaseAIAgent):
     
     def _create_agent_runner(self) -> Optional[ReActAgent]:
         """创建Agent Runner的默认实现"""
+        if self.agent_runner is not None:
+            return self.agent_runner
         try:
-            # 创建Ollama LLM实例
-            llm = Ollama(
-                model=self.llm_interface.model_name,
-                base_url=self.llm_interface.base_url,
-                temperature=self.llm_interface.temperature
+            # 获取共享的Ollama LLM实例
+            llm = _get_shared_llm(
+                self.llm_interface.model_name,
+                self.llm_interface.base_url,
+                self.llm_interface.temperature
             )
             
             # 创建Agent Runner - 使用正确的API
@@ -83,49 +272,225 @@ class BaseGameAgent(BaseAIAgent):
     def add_tool(self, tool: FunctionTool):
         """添加工具到Agent"""
         self.tools.append(tool)
+        self._static_prefix_cache = None
+    
+    @staticmethod
+    def _tool_name(tool) -> str:
+        """获取工具名称"""
+        metadata = getattr(tool, "metadata", None)
+        return getattr(metadata, "name", None) or getattr(tool, "name", str(tool))
     
     async def make_decision(self, context: Dict[str, Any]) -> Dict[str, Any]:
         """使用Agent进行决策"""
+        if self.agent_runner is None:
+            # 回退到基础决策模式
+            return await self._fallback_decision(context)
+        
+        # 相同输入的决策直接复用缓存结果
+        cache_key, cached = self._lookup_decision(context)
+        if cached is not None:
+            return cached
+        
+        # 构建决策提示
+        decision_prompt = self._build_decision_prompt(context)
+        
+        # 使用Agent Runner进行决策（流式读取，解析到目标后提前结束）
+        # 只有LLM调用本身的错误才回退，解析与状态更新的问题不应被掩盖
         try:
-            if self.agent_runner is None:
-                # 回退到基础决策模式
-                return await self._fallback_decision(context)
-            
-            # 构建决策提示
-            decision_prompt = self._build_decision_prompt(context)
-            
-            # 使用Agent Runner进行决策
-            response = await self.agent_runner.achat(decision_prompt)
-            
-            # 解析决策结果
-            decision_result = self._parse_agent_response(response, context)
-            
-            # 记录决策历史
-            self.decision_history.append({
-                "timestamp": datetime.now().isoformat(),
-                "context": context,
-                "decision": decision_result,
-                "response": str(response)
-            })
-            
-            return decision_result
-            
-        except Exception as e:
+            response = await self._stream_decision(decision_prompt)
+        except _LLM_ERRORS as e:
             self.logger.error(f"Agent决策失败: {e}")
             return await self._fallback_decision(context)
+        
+        # 解析决策结果
+        decision_result = self._parse_agent_response(response, context)
+        
+        self._store_decision(cache_key, decision_result)
+        
+        # 记录决策历史
+        self.decision_history.append({
+            "timestamp": datetime.now().isoformat(),
+            "context": context,
+            "decision": decision_result,
+            "response": repr(response)[:DECISION_RESPONSE_PREVIEW]
+        })
+        
+        return decision_result
+    
+    async def _stream_decision(self, prompt: str):
+        """流式获取Agent决策文本；Agent不支持流式时回退到achat"""
+        try:
+            streaming = await self.agent_runner.astream_chat(prompt)
+        except NotImplementedError:
+            return await self.agent_runner.achat(prompt)
+        return await self._collect_decision_stream(streaming.async_response_gen())
+    
+    async def _collect_decision_stream(self, chunks: AsyncIterator[str]) -> str:
+        """累积流式输出，出现final_decision和完整的target_id后立即停止读取"""
+        text = ""
+        scanned = 0
+        has_decision = False
+        has_target = False
+        try:
+            async for chunk in chunks:
+                text += chunk
+                # 只扫描新增部分
+                start = max(0, scanned - _STREAM_SCAN_OVERLAP)
+                scanned = len(text)
+                if not has_decision:
+                    has_decision = "final_decision" in text[start:]
+                if not has_target:
+                    has_target = _TARGET_ID_DONE_RE.search(text, start) is not None
+                if has_decision and has_target:
+                    break
+        finally:
+            aclose = getattr(chunks, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        return text
+    
+    def _decision_cache_enabled(self) -> bool:
+        """只有确定性采样（temperature为0）时，相同输入才会得到相同决策；默认配置（1.1）下缓存不启用"""
+        return getattr(self.llm_interface, "temperature", None) == 0
+    
+    def _decision_cache_key(self, context: Dict[str, Any]) -> str:
+        """根据规范化后的决策输入计算缓存键（只取提示实际用到的字段，不序列化原始game_state）"""
+        game_state = context.get("game_state", {})
+        key_data = {
+            "role": self.role,
+            "pid": self.player_id,
+            "alive": game_state_view(game_state).alive_ids,
+            "game": _game_state_fingerprint(game_state),
+            "vision": sorted(getattr(self, "vision_results", {}).items()),
+            "suspicion": self.format_suspicions(),
+            "context": _allowed_context(context)
+        }
+        return hashlib.blake2b(_canonical_json(key_data), digest_size=16).hexdigest()
+    
+    def _lookup_decision(self, context: Dict[str, Any]) -> tuple:
+        """查询决策缓存，返回(缓存键, 缓存的决策副本)；未启用缓存时键为None"""
+        if not self._decision_cache_enabled():
+            return None, None
+        cache_key = self._decision_cache_key(context)
+        cached = self._decision_cache.get(cache_key)
+        if cached is None:
+            return cache_key, None
+        self._decision_cache.move_to_end(cache_key)
+        return cache_key, dict(cached)
+    
+    def _store_decision(self, cache_key: Optional[str], decision_result: Dict[str, Any]):
+        """写入决策缓存，超出容量时淘汰最久未使用的条目"""
+        if cache_key is None:
+            return
+        self._decision_cache[cache_key] = dict(decision_result)
+        if len(self._decision_cache) > DECISION_CACHE_SIZE:
+            self._decision_cache.popitem(last=False)
+    
+    def invalidate_decision_cache(self):
+        """清空决策缓存（已知信息发生变化时调用）"""
+        self._decision_cache.clear()
+    
+    def _static_system_prompt(self, name: str, build: Callable[[], str]) -> str:
+        """获取与回合无关的系统提示（身份、角色要求等），首次构建后缓存"""
+        text = self._system_prompt_cache.get(name)
+        if text is None:
+            text = build()
+            self._system_prompt_cache[name] = text
+        return text
+    
+    def _invalidate_system_prompts(self):
+        """角色固定信息变化时清空系统提示缓存"""
+        self._system_prompt_cache.clear()
+    
+    def get_role_context(self) -> str:
+        """身份强化后的角色背景（base_prompt），作为系统提示之后的固定前缀"""
+        return self._static_system_prompt("role_context", lambda: self.get_enhanced_prompt("base_prompt"))
+    
+    def begin_phase(self, phase_id: tuple):
+        """进入新的游戏阶段，清空上一阶段的格式化缓存"""
+        if phase_id != self._phase_id:
+            self._phase_id = phase_id
+            self._fmt_cache.clear()
+    
+    def _cached_format(self, key: tuple, build: Callable[[], str]) -> str:
+        """在当前阶段内复用格式化结果"""
+        text = self._fmt_cache.get(key)
+        if text is None:
+            text = build()
+            self._fmt_cache[key] = text
+        return text
+    
+    def _invalidate_format(self, *key):
+        """使某项格式化缓存失效"""
+        self._fmt_cache.pop(key, None)
     
-    async def execute_decision_chain(self, initial_context: Dict[str, Any]) -> Dict[str, Any]:
-        """执行多步骤决策链"""
+    def format_game_context(self, game_state: Dict[str, Any]) -> str:
+        """格式化游戏上下文（同一阶段内相同局面只构建一次）"""
+        key = ("game_context",) + _game_state_fingerprint(game_state)
+        return self._cached_format(key, lambda: self.llm_interface.format_game_context(game_state))
+    
+    def format_suspicions(self) -> str:
+        """格式化怀疑度信息（怀疑度变化前复用结果）"""
+        return self._cached_format(("suspicions",), super().format_suspicions)
+    
+    def update_suspicion(self, target_id: int, suspicion_change: float, reason: str = ""):
+        """更新怀疑度，并使怀疑度文本缓存失效"""
+        super().update_suspicion(target_id, suspicion_change, reason)
+        self._invalidate_format("suspicions")
+    
+    def format_memory_context(self, max_events: int = 5) -> str:
+        """格式化记忆上下文（记忆更新前复用结果）"""
+        text = self._memory_fmt_cache.get(max_events)
+        if text is None:
+            text = super().format_memory_context(max_events)
+            self._memory_fmt_cache[max_events] = text
+        return text
+    
+    def update_memory(self, event_type: str, event_data: Dict[str, Any]):
+        """更新游戏记忆，并使记忆文本缓存失效"""
+        super().update_memory(event_type, event_data)
+        self._memory_fmt_cache.clear()
+    
+    def _record_forced_vote(self, vote_target: int) -> int:
+        """记录无需模型判断的投票（仅剩唯一可投对象）并返回目标"""
+        self.update_memory("votes", {
+            "voter": f"玩家{self.player_id}",
+            "target": f"玩家{vote_target}",
+            "voter_id": self.player_id,
+            "target_id": vote_target,
+            "reason": "唯一可投票的玩家"
+        })
+        return vote_target
+    
+    def die(self, cause: str = "未知"):
+        """玩家死亡"""
+        super().die(cause)
+        self.invalidate_decision_cache()
+    
+    def observe_death(self, player_id: int, cause: str = "未知"):
+        """观察到其他玩家死亡"""
+        super().observe_death(player_id, cause)
+        self.invalidate_decision_cache()
+    
+    async def execute_decision_chain(self, initial_context: Dict[str, Any], 
+                                     max_steps: int = 5) -> Dict[str, Any]:
+        """执行多步骤决策链（max_steps为最大决策步骤数）"""
         try:
+            if max_steps <= 1:
+                # 单步决策无需维护链上下文
+                step_result = await self.make_decision(initial_context)
+                step_result["final_decision"] = True
+                return step_result
+            
             current_context = initial_context.copy()
-            max_steps = 5  # 最大决策步骤数
             
             for step in range(max_steps):
                 # 执行单步决策
                 step_result = await self.make_decision(current_context)
                 
-                # 更新上下文
-                current_context.update(step_result)
+                # 只把后续步骤需要的字段带入上下文，避免提示随步骤膨胀
+                current_context.update({key: step_result[key] for key in _CARRY_KEYS 
+                                        if key in step_result})
                 
                 # 检查是否需要继续决策
                 if step_result.get("final_decision", False):
@@ -143,34 +508,52 @@ class BaseGameAgent(BaseAIAgent):
             return await self._fallback_decision(initial_context)
     
     def _build_decision_prompt(self, context: Dict[str, Any]) -> str:
-        """构建决策提示"""
-        role_context = self.get_role_prompt("base_prompt")
-        game_context = self.llm_interface.format_game_context(context.get("game_state", {}))
-        
-        prompt = f"""
+        """构建决策提示：固定的静态前缀在前，每回合变化的动态内容在后，便于复用前缀缓存"""
+        return self._static_prefix() + self._dynamic_suffix(context)
+    
+    def _static_prefix(self) -> str:
+        """构建与回合无关的提示前缀（角色背景与工具列表），结果会被缓存"""
+        if self._static_prefix_cache is None:
+            role_context = self.get_role_prompt("base_prompt")
+            tool_names = "\n        ".join(self._tool_name(tool) for tool in self.tools)
+            
+            self._static_prefix_cache = f"""
         你是{self.role}角色，玩家{self.player_id}号{self.name}。
         
         角色背景：{role_context}
         
-        当前游戏情况：{game_context}
-        
-        可用工具：{', '.join([getattr(tool, 'name', str(tool)) for tool in self.tools])}
+        可用工具：
+        {tool_names}
         
         请根据当前情况，使用合适的工具进行决策。
         如果需要多步决策，请逐步执行。
-        
-        当前上下文：{context}
         """
         
-        return prompt
+        return self._static_prefix_cache
+    
+    def _dynamic_suffix(self, context: Dict[str, Any]) -> str:
+        """构建每回合变化的动态上下文"""
+        game_context = self.format_game_context(context.get("game_state", {}))
+        context_json = _canonical_json(_allowed_context(context)).decode()
+        
+        return f"""
+        ---- 动态上下文 ----
+        当前游戏情况：{game_context}
+        
+        当前上下文：{context_json}
+        """
     
     def _parse_agent_response(self, response, context: Dict[str, Any]) -> Dict[str, Any]:
         """解析Agent响应"""
         try:
-            # 尝试从响应中提取工具调用结果
-            if hasattr(response, 'message') and hasattr(response.message, 'content'):
+            # 尝试从响应中提取工具调用结果（流式决策直接得到文本）
+            content = None
+            if isinstance(response, str):
+                content = response
+            elif hasattr(response, 'message') and hasattr(response.message, 'content'):
                 content = response.message.content
-                
+            
+            if content is not None:
                 # 解析工具调用结果
                 result = self._extract_tool_results(content)
                 
@@ -228,8 +611,8 @@ class BaseGameAgent(BaseAIAgent):
             }
     
     def get_decision_history(self) -> List[Dict[str, Any]]:
-        """获取决策历史"""
-        return self.decision_history.copy()
+        """获取决策历史快照"""
+        return list(self.decision_history)
     
     def clear_decision_history(self):
         """清空决策历史"""
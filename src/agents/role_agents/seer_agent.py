@@ -4,23 +4,54 @@
 """
 
 import logging
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Set
 from llama_index.core.agent import AgentRunner
 from llama_index.core.tools import FunctionTool
 
-from ..base_agent import BaseGameAgent
+from ..base_agent import BaseGameAgent, TARGET_ID_RE, alive_id_mask, extract_response_text, iter_bits
+from ...ai_agent import compile_speech_filter
 from ..tools.seer_tools import SeerTools
 
+# 预言家发言中需要屏蔽的暴露身份词汇
+SEER_FORBIDDEN_WORDS = (
+    "预言家", "查验", "神", "预言", "天启", "洞察", "神职", "能力",
+    "确认身份", "查明身份", "神圣", "启示", "真相", "探查", "验证",
+    "狼人身份", "村民身份", "确定是", "我知道", "我看出", "发现了"
+)
+
+
+def _select_target(suspicions: Dict[int, float], candidates: List[int], 
+                   threshold: float = 0.1) -> Optional[int]:
+    """单次遍历候选人，返回怀疑度最高且超过阈值的玩家，没有则返回None"""
+    best_target, best_score = None, threshold
+    for candidate in candidates:
+        score = suspicions.get(candidate, 0.0)
+        if score > best_score:
+            best_target, best_score = candidate, score
+    return best_target
+
 
 class SeerAgent(BaseGameAgent):
     """预言家Agent类"""
     
+    # 基础过滤规则与预言家屏蔽词合并，发言只需扫描一遍
+    _speech_filter_re = compile_speech_filter(SEER_FORBIDDEN_WORDS)
+    
     def __init__(self, player_id: int, name: str, llm_interface, prompts: Dict[str, Any], 
                  identity_system=None, memory_config=None):
         super().__init__(player_id, name, "seer", llm_interface, prompts, identity_system, memory_config)
         
         # 预言家特有属性
         self.vision_results = {}  # 查验结果 {player_id: role}
+        
+        # 查验状态位掩码（第player_id位表示该玩家）
+        self.verified_mask = 0
+        self.werewolf_mask = 0
+        # 已查验的狼人/好人集合，接收查验结果时维护
+        self.known_werewolves_set: Set[int] = set()
+        self.known_villagers_set: Set[int] = set()
+        # 已格式化的查验结果片段，按查验顺序追加
+        self._vision_str_parts: List[str] = []
         self.revealed = False  # 是否已公开身份
         
         # 预言家已知信息
@@ -62,11 +93,26 @@ class SeerAgent(BaseGameAgent):
                 self.logger.warning("Agent Runner未初始化，使用基础决策")
                 return await self._basic_night_action(game_state)
             
-            # 构建Agent提示
-            agent_prompt = self._build_seer_agent_prompt(game_state)
+            # 查验目标已经确定时无需调用LLM
+            forced_result = self._get_forced_divine_decision(game_state)
+            if forced_result is not None:
+                self.update_memory("night_actions", {
+                    "action": "divine",
+                    "target": forced_result.get("target"),
+                    "player_id": self.player_id,
+                    "mode": "forced"
+                })
+                return forced_result
             
-            # 使用Agent进行决策（暂时使用传统方式）
-            response = await self.llm_interface.generate_response(agent_prompt)
+            # 格式化提示所需的各部分，再构建Agent提示
+            game_context = self.format_game_context(game_state)
+            vision_results = self._format_vision_results()
+            suspicion_info = self.format_suspicions()
+            agent_prompt = self._build_seer_agent_prompt(game_context, vision_results, suspicion_info)
+            
+            # 流式生成，解析到查验目标后立即停止
+            response = await self._collect_decision_stream(
+                self.llm_interface.stream_response(agent_prompt))
             
             # 解析Agent响应
             action_result = self._parse_agent_response(response, game_state)
@@ -76,7 +122,7 @@ class SeerAgent(BaseGameAgent):
                 "action": "divine",
                 "target": action_result.get("target"),
                 "player_id": self.player_id,
-                "agent_response": str(response),
+                "agent_response": extract_response_text(response),
                 "mode": "agent"
             })
             
@@ -87,15 +133,21 @@ class SeerAgent(BaseGameAgent):
             # 回退到基础决策
             return await self._basic_night_action(game_state)
     
-    def _build_seer_agent_prompt(self, game_state: Dict[str, Any]) -> str:
-        """构建预言家Agent提示"""
-        game_context = self.llm_interface.format_game_context(game_state)
-        vision_results = self._format_vision_results()
-        suspicion_info = self.format_suspicions()
-        
+    def _build_seer_agent_prompt(self, game_context: str, vision_results: str, 
+                                 suspicion_info: str) -> str:
+        """用已格式化的游戏情况、查验历史和怀疑情况构建预言家Agent提示"""
+        # 固定的任务说明在前，本回合的动态信息在后
         prompt = f"""
         你是预言家，现在是夜晚查验时间。
         
+        你的任务：
+        1. 分析可疑玩家，选择查验目标
+        2. 评估查验价值
+        3. 执行查验行动
+        
+        请使用提供的工具函数来完成查验决策。优先查验最可疑的玩家。
+        
+        ---- 动态上下文 ----
         当前游戏情况：
         {game_context}
         
@@ -104,13 +156,6 @@ class SeerAgent(BaseGameAgent):
         
         你的怀疑情况：
         {suspicion_info}
-        
-        你的任务：
-        1. 分析可疑玩家，选择查验目标
-        2. 评估查验价值
-        3. 执行查验行动
-        
-        请使用提供的工具函数来完成查验决策。优先查验最可疑的玩家。
         """
         
         return prompt
@@ -119,15 +164,14 @@ class SeerAgent(BaseGameAgent):
         """解析Agent响应"""
         try:
             # 从Agent响应中提取决策信息
-            response_text = str(response)
+            response_text = extract_response_text(response)
             
             # 查找最终决策
             if "final_decision" in response_text and "target_id" in response_text:
                 # 尝试提取目标ID
-                import re
-                target_matches = re.findall(r'target_id["\']?\s*:\s*(\d+)', response_text)
-                if target_matches:
-                    target_id = int(target_matches[0])
+                target_match = TARGET_ID_RE.search(response_text)
+                if target_match:
+                    target_id = int(target_match.group(1))
                     return {
                         "action": "divine",
                         "target": target_id,
@@ -143,15 +187,33 @@ class SeerAgent(BaseGameAgent):
             self.logger.error(f"解析Agent响应失败: {e}")
             return self._get_default_divine_decision(game_state)
     
+    def _get_forced_divine_decision(self, game_state: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """只剩一个未查验玩家、或某个未查验玩家几乎确定是狼人时，直接给出查验决策"""
+        unverified_mask = self._unverified_mask(game_state)
+        if not unverified_mask:
+            return self._get_default_divine_decision(game_state)
+        
+        if unverified_mask.bit_count() == 1:
+            target = unverified_mask.bit_length() - 1
+        else:
+            target = next((p for p in iter_bits(unverified_mask) 
+                           if self.suspicions.get(p, 0.0) >= 0.99), None)
+            if target is None:
+                return None
+        
+        return {
+            "action": "divine",
+            "target": target,
+            "success": True,
+            "message": f"预言家选择查验玩家{target}"
+        }
+    
     def _get_default_divine_decision(self, game_state: Dict[str, Any]) -> Dict[str, Any]:
         """获取默认查验决策"""
         # 选择最可疑的未查验玩家
-        alive_players = [p["id"] for p in game_state.get("alive_players", []) 
-                        if p["id"] != self.player_id]
-        unverified_players = [p for p in alive_players 
-                            if p not in self.vision_results]
+        unverified_mask = self._unverified_mask(game_state)
         
-        if not unverified_players:
+        if not unverified_mask:
             return {
                 "action": "divine",
                 "success": False,
@@ -161,7 +223,7 @@ class SeerAgent(BaseGameAgent):
         # 选择最可疑的玩家
         most_suspicious = self.get_most_suspicious_players(1)
         for suspect in most_suspicious:
-            if suspect in unverified_players:
+            if unverified_mask >> suspect & 1:
                 return {
                     "action": "divine",
                     "target": suspect,
@@ -170,8 +232,7 @@ class SeerAgent(BaseGameAgent):
                 }
         
         # 随机选择
-        import random
-        target = random.choice(unverified_players)
+        target = self._rng.choice(list(iter_bits(unverified_mask)))
         return {
             "action": "divine",
             "target": target,
@@ -182,12 +243,8 @@ class SeerAgent(BaseGameAgent):
     async def _basic_night_action(self, game_state: Dict[str, Any]) -> Dict[str, Any]:
         """基础夜晚行动（备用方案）"""
         try:
-            alive_players = [p["id"] for p in game_state.get("alive_players", []) 
-                           if p["id"] != self.player_id]
-            
-            # 排除已经查验过的玩家
-            unverified_players = [p for p in alive_players 
-                                if p not in self.vision_results]
+            # 存活且未查验过的其他玩家
+            unverified_players = list(iter_bits(self._unverified_mask(game_state)))
             
             if not unverified_players:
                 return {
@@ -214,42 +271,48 @@ class SeerAgent(BaseGameAgent):
                 "message": "查验行动失败"
             }
     
+    def _unverified_mask(self, game_state: Dict[str, Any]) -> int:
+        """存活、未查验且不是自己的玩家位掩码"""
+        return alive_id_mask(game_state) & ~self.verified_mask & ~(1 << self.player_id)
+    
     def receive_vision_result(self, target_id: int, target_role: str):
         """接收查验结果"""
+        if not self.verified_mask >> target_id & 1:
+            role_desc = "狼人" if target_role == "werewolf" else "好人"
+            self._vision_str_parts.append(f"玩家{target_id}({role_desc})")
         self.vision_results[target_id] = target_role
+        self.verified_mask |= 1 << target_id
         
         if target_role == "werewolf":
+            self.werewolf_mask |= 1 << target_id
+            self.known_werewolves_set.add(target_id)
+            self.known_villagers_set.discard(target_id)
             self.role_info["known_werewolves"].append(target_id)
-            self.update_suspicion(target_id, 1.0, f"查验确认为狼人")
+            confirmed, reason = 1.0, "查验确认为狼人"
         else:
+            self.known_villagers_set.add(target_id)
+            self.known_werewolves_set.discard(target_id)
             self.role_info["known_villagers"].append(target_id)
-            self.update_suspicion(target_id, -1.0, f"查验确认为村民")
+            confirmed, reason = -1.0, "查验确认为村民"
+        
+        # 查验结果是确定信息，怀疑度直接设为端点值而不是在原值上增减
+        self.update_suspicion(target_id, confirmed - self.suspicions.get(target_id, 0.0), reason)
         
+        self.invalidate_decision_cache()
         self.logger.info(f"预言家{self.player_id}查验玩家{target_id}：{target_role}")
     
     def _format_vision_results(self) -> str:
-        """格式化查验结果为文本"""
-        if not self.vision_results:
+        """格式化查验结果为文本（片段在接收查验结果时增量生成）"""
+        if not self._vision_str_parts:
             return "尚未进行查验"
         
-        results = []
-        for player_id, role in self.vision_results.items():
-            role_desc = "狼人" if role == "werewolf" else "好人"
-            results.append(f"玩家{player_id}({role_desc})")
-        
-        return "查验结果: " + ", ".join(results)
+        return "查验结果: " + ", ".join(self._vision_str_parts)
     
     def _choose_divine_target(self, candidates: List[int], game_state: Dict[str, Any]) -> int:
         """智能选择查验目标"""
-        # 获取最可疑的玩家
-        most_suspicious = self.get_most_suspicious_players(3)
-        for suspect in most_suspicious:
-            if suspect in candidates:
-                return suspect
-        
-        # 如果没有明显可疑的，随机选择
-        import random
-        return random.choice(candidates)
+        # 选择候选人中最可疑的玩家，没有明显可疑的则随机选择
+        target = _select_target(self.suspicions, candidates)
+        return target if target is not None else self._rng.choice(candidates)
     
     async def make_speech(self, game_state: Dict[str, Any]) -> str:
         """预言家发言（保持原有逻辑）"""
@@ -257,7 +320,7 @@ class SeerAgent(BaseGameAgent):
             # 使用身份强化的提示词
             identity_context = self.get_identity_context()
             enhanced_speech_prompt = self.get_enhanced_prompt("speech_prompt")
-            game_context = self.llm_interface.format_game_context(game_state)
+            game_context = self.format_game_context(game_state)
             memory_context = self.format_memory_context()
             suspicion_info = self.format_suspicions()
             
@@ -300,15 +363,15 @@ class SeerAgent(BaseGameAgent):
     
     async def vote(self, game_state: Dict[str, Any], candidates: List[int]) -> int:
         """预言家投票（保持原有逻辑）"""
+        # 候选人只过滤一次，异常分支同样复用
+        valid_candidates = [c for c in candidates if c != self.player_id] or candidates
         try:
-            valid_candidates = [c for c in candidates if c != self.player_id]
-            if not valid_candidates:
-                import random
-                return random.choice(candidates)
+            if len(valid_candidates) == 1:
+                return valid_candidates[0]
             
             # 优先投票给已确认的狼人
             confirmed_werewolves = [p for p in valid_candidates 
-                                  if self.vision_results.get(p) == "werewolf"]
+                                  if self.werewolf_mask >> p & 1]
             
             if confirmed_werewolves:
                 return confirmed_werewolves[0]
@@ -318,30 +381,17 @@ class SeerAgent(BaseGameAgent):
             if most_suspicious and most_suspicious[0] in valid_candidates:
                 return most_suspicious[0]
             
-            import random
-            return random.choice(valid_candidates)
+            return self._rng.choice(valid_candidates)
             
         except Exception as e:
             self.logger.error(f"预言家投票时出错: {e}")
-            import random
-            return random.choice([c for c in candidates if c != self.player_id])
+            return self._rng.choice(valid_candidates)
     
     def _filter_seer_speech(self, speech: str) -> str:
         """预言家发言专用过滤器"""
-        # 基础过滤
+        # 基础过滤与预言家屏蔽词合并为一次扫描
         filtered = self._filter_speech_output(speech)
         
-        # 预言家特定过滤
-        seer_forbidden_words = [
-            "预言家", "查验", "神", "预言", "天启", "洞察", "神职", "能力",
-            "确认身份", "查明身份", "神圣", "启示", "真相", "探查", "验证",
-            "狼人身份", "村民身份", "确定是", "我知道", "我看出", "发现了"
-        ]
-        
-        for word in seer_forbidden_words:
-            if word in filtered:
-                filtered = filtered.replace(word, "")
-        
         # 如果过滤后内容过短，返回安全默认内容
         if len(filtered.strip()) < 10:
             return "我觉得需要更仔细地观察大家的行为。"
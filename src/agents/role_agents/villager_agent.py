@@ -4,17 +4,87 @@
 """
 
 import logging
-from typing import Dict, Any, List, Optional
+import re
+from bisect import bisect_left, bisect_right
+from itertools import islice
+from typing import Dict, Any, List, Optional, Tuple
 from llama_index.core.agent import AgentRunner
 from llama_index.core.tools import FunctionTool
 
-from ..base_agent import BaseGameAgent
+from ..base_agent import BaseGameAgent, extract_response_text
 from ..tools.common_tools import CommonTools
 
+# 夜晚反思中提及的玩家与情感词汇
+_PLAYER_RE = re.compile(r'玩家(\d+)')
+_POSITIVE_WORDS = frozenset(['相信', '信任', '无辜', '可靠', '真实'])
+_NEGATIVE_WORDS = frozenset(['怀疑', '可疑', '狡猾', '撒谎', '奇怪'])
+_SENTIMENT_RE = re.compile("|".join(map(re.escape, sorted(_POSITIVE_WORDS | _NEGATIVE_WORDS))))
+# 只统计玩家提及前后这么多字符内的情感词
+_REFLECTION_WINDOW = 40
+
 
 class VillagerAgent(BaseGameAgent):
     """村民Agent类"""
     
+    # 夜晚反思的Agent提示模板
+    _NIGHT_PROMPT_TEMPLATE = """
+    你是村民，现在是夜晚反思时间。
+
+    当前游戏情况：
+    {game_context}
+
+    你的怀疑情况：
+    {suspicion_info}
+
+    你的记忆：
+    {memory_context}
+
+    你的任务：
+    1. 分析当天的情况
+    2. 收集信息并推理
+    3. 制定明天的策略
+    4. 进行夜晚反思
+
+    请使用提供的工具函数来进行深度分析和推理。作为村民，你需要通过逻辑推理找出狼人。
+    """
+    
+    # 基础夜晚反思提示模板
+    _REFLECTION_TEMPLATE = """
+    回顾今天的讨论和投票，作为村民，你有什么新的想法？
+
+    当前游戏情况：
+    {game_context}
+
+    你的怀疑情况：
+    {suspicion_info}
+
+    今天的记忆：
+    {memory_context}
+
+    请简短分析，对明天的策略有什么想法？
+    """
+    
+    # 发言的动态提示模板
+    _SPEECH_TEMPLATE = """
+    当前游戏情况：
+    {game_context}
+
+    你的记忆：
+    {memory_context}
+
+    {suspicion_info}
+    """
+    
+    # 投票的动态提示模板
+    _VOTE_TEMPLATE = """
+    当前游戏情况：
+    {game_context}
+
+    {suspicion_info}
+
+    可投票的玩家：{candidate_info}
+    """
+    
     def __init__(self, player_id: int, name: str, llm_interface, prompts: Dict[str, Any], 
                  identity_system=None, memory_config=None):
         super().__init__(player_id, name, "villager", llm_interface, prompts, identity_system, memory_config)
@@ -53,13 +123,14 @@ class VillagerAgent(BaseGameAgent):
     
     async def night_action(self, game_state: Dict[str, Any]) -> Dict[str, Any]:
         """村民夜晚行动（Agent模式）"""
+        ctx_bundle = None
         try:
             if not self.agent_runner:
                 self.logger.warning("Agent Runner未初始化，使用基础决策")
                 return await self._basic_night_action(game_state)
             
             # 构建Agent提示
-            agent_prompt = self._build_villager_agent_prompt(game_state)
+            agent_prompt, ctx_bundle = self._build_villager_agent_prompt(game_state)
             
             # 使用Agent进行决策（暂时使用传统方式）
             response = await self.llm_interface.generate_response(agent_prompt)
@@ -72,7 +143,7 @@ class VillagerAgent(BaseGameAgent):
                 "action": "reflect",
                 "content": response,
                 "player_id": self.player_id,
-                "agent_response": str(response),
+                "agent_response": extract_response_text(response),
                 "mode": "agent"
             })
             
@@ -80,43 +151,29 @@ class VillagerAgent(BaseGameAgent):
             
         except Exception as e:
             self.logger.error(f"村民Agent夜晚行动失败: {e}")
-            # 回退到基础决策
-            return await self._basic_night_action(game_state)
+            # 回退到基础决策，复用已格式化的局势与怀疑度文本
+            return await self._basic_night_action(game_state, ctx_bundle)
     
-    def _build_villager_agent_prompt(self, game_state: Dict[str, Any]) -> str:
-        """构建村民Agent提示"""
-        game_context = self.llm_interface.format_game_context(game_state)
+    def _build_villager_agent_prompt(self, game_state: Dict[str, Any]) -> Tuple[str, Dict[str, str]]:
+        """构建村民Agent提示，同时返回用到的上下文文本供备用方案复用"""
+        game_context = self.format_game_context(game_state)
         suspicion_info = self.format_suspicions()
         memory_context = self.format_memory_context()
         
-        prompt = f"""
-        你是村民，现在是夜晚反思时间。
-        
-        当前游戏情况：
-        {game_context}
-        
-        你的怀疑情况：
-        {suspicion_info}
-        
-        你的记忆：
-        {memory_context}
-        
-        你的任务：
-        1. 分析当天的情况
-        2. 收集信息并推理
-        3. 制定明天的策略
-        4. 进行夜晚反思
+        prompt = self._NIGHT_PROMPT_TEMPLATE.format_map({
+            "game_context": game_context,
+            "suspicion_info": suspicion_info,
+            "memory_context": memory_context
+        })
         
-        请使用提供的工具函数来进行深度分析和推理。作为村民，你需要通过逻辑推理找出狼人。
-        """
-        
-        return prompt
+        ctx_bundle = {"game": game_context, "susp": suspicion_info, "mem": memory_context}
+        return prompt, ctx_bundle
     
     def _parse_agent_response(self, response, game_state: Dict[str, Any]) -> Dict[str, Any]:
         """解析Agent响应"""
         try:
             # 从Agent响应中提取决策信息
-            response_text = str(response)
+            response_text = extract_response_text(response)
             
             # 村民的夜晚行动主要是反思和分析
             return {
@@ -135,24 +192,21 @@ class VillagerAgent(BaseGameAgent):
                 "message": "夜晚反思失败"
             }
     
-    async def _basic_night_action(self, game_state: Dict[str, Any]) -> Dict[str, Any]:
-        """基础夜晚行动（备用方案）"""
+    async def _basic_night_action(self, game_state: Dict[str, Any], 
+                                  ctx_bundle: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        """基础夜晚行动（备用方案）；ctx_bundle为Agent模式已格式化的上下文文本"""
         try:
-            # 分析当天的情况
-            analysis_prompt = f"""
-            回顾今天的讨论和投票，作为村民，你有什么新的想法？
-            
-            当前游戏情况：
-            {self.llm_interface.format_game_context(game_state)}
-            
-            你的怀疑情况：
-            {self.format_suspicions()}
+            ctx_bundle = ctx_bundle or {}
+            game_context = ctx_bundle.get("game") or self.format_game_context(game_state)
+            suspicion_info = ctx_bundle.get("susp") or self.format_suspicions()
+            memory_context = self.format_memory_context(3)
             
-            今天的记忆：
-            {self.format_memory_context(3)}
-            
-            请简短分析，对明天的策略有什么想法？
-            """
+            # 分析当天的情况
+            analysis_prompt = self._REFLECTION_TEMPLATE.format_map({
+                "game_context": game_context,
+                "suspicion_info": suspicion_info,
+                "memory_context": memory_context
+            })
             
             role_context = self.get_role_prompt("base_prompt")
             reflection = await self.llm_interface.generate_response(
@@ -186,31 +240,33 @@ class VillagerAgent(BaseGameAgent):
     async def _adjust_suspicions_based_on_reflection(self, reflection: str):
         """基于反思调整怀疑度"""
         try:
-            # 这里可以实现更复杂的逻辑来解析反思内容并调整怀疑度
-            import re
-            
-            # 寻找提到的玩家和情感词汇
-            player_mentions = re.findall(r'玩家(\d+)', reflection)
-            
-            positive_words = ['相信', '信任', '无辜', '可靠', '真实']
-            negative_words = ['怀疑', '可疑', '狡猾', '撒谎', '奇怪']
-            
-            for player_id_str in player_mentions:
-                player_id = int(player_id_str)
+            # 寻找提到的玩家
+            mentions = list(_PLAYER_RE.finditer(reflection))
+            if not mentions:
+                return
+            
+            # 一次扫描找出所有情感词的位置与倾向（正面为+1，负面为-1）
+            sentiment_hits = [(m.start(), 1 if m.group() in _POSITIVE_WORDS else -1)
+                              for m in _SENTIMENT_RE.finditer(reflection)]
+            positions = [pos for pos, _ in sentiment_hits]
+            
+            # 只看每次提及附近的情感词，先累计每位玩家的变化量，再统一更新一次怀疑度
+            deltas: Dict[int, float] = {}
+            for mention in mentions:
+                player_id = int(mention.group(1))
                 if player_id == self.player_id:
                     continue
                 
-                # 检查周围的词汇
-                player_context = reflection.lower()
-                
-                # 简单的情感分析
-                positive_score = sum(1 for word in positive_words if word in player_context)
-                negative_score = sum(1 for word in negative_words if word in player_context)
+                lo = bisect_left(positions, mention.start() - _REFLECTION_WINDOW)
+                hi = bisect_right(positions, mention.end() + _REFLECTION_WINDOW)
+                score = sum(polarity for _, polarity in sentiment_hits[lo:hi])
                 
-                if positive_score > negative_score:
-                    self.update_suspicion(player_id, -0.1, "夜晚反思 - 正面评价")
-                elif negative_score > positive_score:
-                    self.update_suspicion(player_id, 0.1, "夜晚反思 - 负面评价")
+                if score:
+                    deltas[player_id] = deltas.get(player_id, 0.0) + (-0.1 if score > 0 else 0.1)
+            
+            for player_id, delta in deltas.items():
+                reason = "夜晚反思 - 正面评价" if delta < 0 else "夜晚反思 - 负面评价"
+                self.update_suspicion(player_id, delta, reason)
                     
         except Exception as e:
             self.logger.error(f"调整怀疑度时出错: {e}")
@@ -218,34 +274,21 @@ class VillagerAgent(BaseGameAgent):
     async def make_speech(self, game_state: Dict[str, Any]) -> str:
         """村民发言（保持原有逻辑）"""
         try:
-            # 使用身份强化的提示词
-            identity_context = self.get_identity_context()
-            enhanced_speech_prompt = self.get_enhanced_prompt("speech_prompt")
-            game_context = self.llm_interface.format_game_context(game_state)
+            # 固定的身份与发言要求作为系统提示，本回合的动态信息作为用户提示
+            system_prompt = self._static_system_prompt("speech", self._build_speech_system_prompt)
+            game_context = self.format_game_context(game_state)
             memory_context = self.format_memory_context()
             suspicion_info = self.format_suspicions()
             
-            speech_prompt = f"""
-            {identity_context}
-            
-            {enhanced_speech_prompt}
-            
-            当前游戏情况：
-            {game_context}
-            
-            你的记忆：
-            {memory_context}
-            
-            {suspicion_info}
-            
-            请以玩家{self.player_id}号{self.name}的身份发表观点，体现你的个性特征和说话风格。
-            表达怀疑或支持某些玩家时要保持逻辑性，不要过于冲动。
-            """
+            speech_prompt = self._SPEECH_TEMPLATE.format_map({
+                "game_context": game_context,
+                "memory_context": memory_context,
+                "suspicion_info": suspicion_info
+            })
             
             # 使用身份强化的角色上下文
-            enhanced_role_context = self.get_enhanced_prompt("base_prompt")
             response = await self.llm_interface.generate_response(
-                speech_prompt, enhanced_role_context
+                speech_prompt, self.get_role_context(), system_prompt
             )
             
             # 过滤输出内容
@@ -270,37 +313,27 @@ class VillagerAgent(BaseGameAgent):
             # 移除自己
             valid_candidates = [c for c in candidates if c != self.player_id]
             if not valid_candidates:
-                import random
-                return random.choice(candidates)
+                return self._rng.choice(candidates)
+            
+            if len(valid_candidates) == 1:
+                # 只有一个可投对象时结果已确定，无需调用模型
+                return self._record_forced_vote(valid_candidates[0])
             
-            # 使用身份强化的投票提示
-            identity_context = self.get_identity_context()
-            enhanced_vote_prompt = self.get_enhanced_prompt("vote_prompt")
-            game_context = self.llm_interface.format_game_context(game_state)
+            # 固定的身份与投票要求作为系统提示，局势与候选人作为用户提示
+            system_prompt = self._static_system_prompt("vote", self._build_vote_system_prompt)
+            game_context = self.format_game_context(game_state)
             suspicion_info = self.format_suspicions()
             
             candidate_info = ", ".join([f"玩家{c}" for c in valid_candidates])
             
-            voting_prompt = f"""
-            {identity_context}
-            
-            {enhanced_vote_prompt}
-            
-            当前游戏情况：
-            {game_context}
-            
-            {suspicion_info}
-            
-            可投票的玩家：{candidate_info}
-            
-            请以玩家{self.player_id}号{self.name}的身份选择投票，体现你的个性和判断风格。
-            选择一个玩家投票，并简单说明理由。
-            格式：投票给玩家X，理由：XXXX
-            """
+            voting_prompt = self._VOTE_TEMPLATE.format_map({
+                "game_context": game_context,
+                "suspicion_info": suspicion_info,
+                "candidate_info": candidate_info
+            })
             
-            enhanced_role_context = self.get_enhanced_prompt("base_prompt")
             response = await self.llm_interface.generate_response(
-                voting_prompt, enhanced_role_context
+                voting_prompt, self.get_role_context(), system_prompt
             )
             
             # 提取投票目标
@@ -312,8 +345,7 @@ class VillagerAgent(BaseGameAgent):
                 if most_suspicious and most_suspicious[0] in valid_candidates:
                     vote_target = most_suspicious[0]
                 else:
-                    import random
-                    vote_target = random.choice(valid_candidates)
+                    vote_target = self._rng.choice(valid_candidates)
             
             # 记录投票
             self.update_memory("votes", {
@@ -328,8 +360,30 @@ class VillagerAgent(BaseGameAgent):
             
         except Exception as e:
             self.logger.error(f"村民投票时出错: {e}")
-            import random
-            return random.choice([c for c in candidates if c != self.player_id]) if candidates else candidates[0]
+            return self._rng.choice([c for c in candidates if c != self.player_id]) if candidates else candidates[0]
+    
+    def _build_speech_system_prompt(self) -> str:
+        """构建村民发言的固定系统提示"""
+        return f"""
+            {self.get_identity_context()}
+            
+            {self.get_enhanced_prompt("speech_prompt")}
+            
+            请以玩家{self.player_id}号{self.name}的身份发表观点，体现你的个性特征和说话风格。
+            表达怀疑或支持某些玩家时要保持逻辑性，不要过于冲动。
+            """
+    
+    def _build_vote_system_prompt(self) -> str:
+        """构建村民投票的固定系统提示"""
+        return f"""
+            {self.get_identity_context()}
+            
+            {self.get_enhanced_prompt("vote_prompt")}
+            
+            请以玩家{self.player_id}号{self.name}的身份选择投票，体现你的个性和判断风格。
+            选择一个玩家投票，并简单说明理由。
+            格式：投票给玩家X，理由：XXXX
+            """
     
     def analyze_voting_pattern(self, voting_results: Dict[int, int]):
         """分析投票模式"""
@@ -354,6 +408,6 @@ class VillagerAgent(BaseGameAgent):
         strategy = f"村民{self.player_id}的策略：\n"
         strategy += f"- 最怀疑：{most_suspicious}\n"
         strategy += f"- 最信任：{least_suspicious}\n"
-        strategy += f"- 当前怀疑度分布：{dict(list(self.suspicions.items())[:5])}"
+        strategy += f"- 当前怀疑度分布：{dict(islice(self.suspicions.items(), 5))}"
         
         return strategy 
\ No newline at end of file
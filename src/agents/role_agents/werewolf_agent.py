@@ -8,22 +8,69 @@ from typing import Dict, Any, List, Optional
 from llama_index.core.agent import AgentRunner
 from llama_index.core.tools import FunctionTool
 
-from ..base_agent import BaseGameAgent
+from ..base_agent import (BaseGameAgent, TARGET_ID_RE, alive_id_mask, extract_response_text,
+                          iter_bits, parse_json_decision)
+from ...ai_agent import compile_speech_filter
 from ..tools.werewolf_tools import WerewolfTools
 
+# 狼人发言中需要屏蔽的暴露身份词汇
+WEREWOLF_FORBIDDEN_WORDS = (
+    "狼人", "同伴", "队友", "击杀", "杀人", "夜晚", "伪装", "欺骗",
+    "狼群", "狼队", "狼人身份", "我是狼", "我们狼", "狼人同伴",
+    "击杀目标", "杀人计划", "伪装策略", "欺骗村民", "狼人团队"
+)
+
 
 class WerewolfAgent(BaseGameAgent):
     """狼人Agent类"""
     
+    # 基础过滤规则与狼人屏蔽词合并，发言只需扫描一遍
+    _speech_filter_re = compile_speech_filter(WEREWOLF_FORBIDDEN_WORDS)
+    
+    # 夜晚击杀的动态提示模板
+    _NIGHT_PROMPT_TEMPLATE = """
+    当前游戏情况：
+    {game_context}
+
+    你的怀疑情况：
+    {suspicion_info}
+    """
+    
+    # 伪装发言的动态提示模板
+    _SPEECH_TEMPLATE = """
+    当前游戏情况：
+    {game_context}
+
+    你的记忆：
+    {memory_context}
+
+    你可以表达的怀疑：
+    {fake_suspicions}
+    """
+    
+    # 伪装投票的动态提示模板
+    _VOTE_TEMPLATE = """
+    当前游戏情况：
+    {game_context}
+
+    你的虚假怀疑（用于误导）：
+    {fake_suspicions}
+
+    可投票的玩家：{candidate_info}
+    """
+    
     def __init__(self, player_id: int, name: str, llm_interface, prompts: Dict[str, Any], 
                  identity_system=None, memory_config=None):
         super().__init__(player_id, name, "werewolf", llm_interface, prompts, identity_system, memory_config)
         
         # 狼人特有属性
         self.teammates = []  # 狼人同伴列表
+        self.teammates_set = frozenset()  # 同伴集合，用于快速成员判断
+        self._exclude_mask = 1 << player_id  # 自己与同伴的位掩码，筛选目标时排除
         self.disguise_strategy = "low_profile"  # 伪装策略：low_profile, active, leader
         self.kill_priority = []  # 击杀优先级列表
         self.fake_suspicions = {}  # 虚假怀疑（用于误导）
+        self._round_fake_suspicions = (None, "")  # (轮次, 伪装怀疑文本)，同一轮发言与投票保持一致
         
         # 狼人知道所有同伴身份
         self.role_info["known_werewolves"] = []
@@ -60,11 +107,22 @@ class WerewolfAgent(BaseGameAgent):
     def set_teammates(self, teammates: List[int]):
         """设置狼人同伴"""
         self.teammates = [t for t in teammates if t != self.player_id]
+        self.teammates_set = frozenset(self.teammates)
+        self._exclude_mask = 1 << self.player_id
+        for teammate in self.teammates:
+            self._exclude_mask |= 1 << teammate
         self.role_info["known_werewolves"] = self.teammates.copy()
         
         # 对同伴的怀疑度设为最低
         for teammate in self.teammates:
             self.suspicions[teammate] = -1.0
+        self._suspicion_ranking = None
+        self._invalidate_format("suspicions")
+        self._invalidate_system_prompts()
+    
+    def _non_teammate_alive_ids(self, game_state: Dict[str, Any]) -> List[int]:
+        """存活的非狼人同伴玩家ID（不含自己），按ID排序"""
+        return list(iter_bits(alive_id_mask(game_state) & ~self._exclude_mask))
     
     async def night_action(self, game_state: Dict[str, Any]) -> Dict[str, Any]:
         """狼人夜晚击杀行动（Agent模式）"""
@@ -73,11 +131,15 @@ class WerewolfAgent(BaseGameAgent):
                 self.logger.warning("Agent Runner未初始化，使用基础决策")
                 return await self._basic_night_action(game_state)
             
-            # 构建Agent提示
+            # 构建Agent提示：固定的任务说明作为系统提示，局势作为用户提示
             agent_prompt = self._build_werewolf_agent_prompt(game_state)
+            system_prompt = self._static_system_prompt("night", self._build_night_system_prompt)
             
-            # 使用Agent进行决策（暂时使用传统方式）
-            response = await self.llm_interface.generate_response(agent_prompt)
+            # 使用Agent进行决策（暂时使用传统方式）；要求JSON输出，相同局势直接复用之前的回复
+            response = await self.llm_interface.generate_response(
+                agent_prompt, system_prompt=system_prompt, use_thinking=False,
+                use_cache=True, json_mode=True
+            )
             
             # 解析Agent响应
             action_result = self._parse_agent_response(response, game_state)
@@ -87,7 +149,7 @@ class WerewolfAgent(BaseGameAgent):
                 "action": "kill",
                 "target": action_result.get("target"),
                 "player_id": self.player_id,
-                "agent_response": str(response),
+                "agent_response": extract_response_text(response),
                 "mode": "agent"
             })
             
@@ -98,22 +160,13 @@ class WerewolfAgent(BaseGameAgent):
             # 回退到基础决策
             return await self._basic_night_action(game_state)
     
-    def _build_werewolf_agent_prompt(self, game_state: Dict[str, Any]) -> str:
-        """构建狼人Agent提示"""
-        game_context = self.llm_interface.format_game_context(game_state)
-        suspicion_info = self.format_suspicions()
-        
-        prompt = f"""
+    def _build_night_system_prompt(self) -> str:
+        """构建狼人夜晚击杀的固定系统提示"""
+        return f"""
         你是狼人，现在是夜晚击杀时间。
         
-        当前游戏情况：
-        {game_context}
-        
         你的同伴：{self.teammates}
         
-        你的怀疑情况：
-        {suspicion_info}
-        
         你的任务：
         1. 分析威胁等级
         2. 与同伴协调行动
@@ -121,7 +174,19 @@ class WerewolfAgent(BaseGameAgent):
         4. 执行击杀行动
         
         请使用提供的工具函数来完成击杀决策。优先击杀对狼人威胁最大的村民。
+        
+        只输出紧凑的JSON：{{"final_decision": true, "target_id": <玩家编号>}}
         """
+    
+    def _build_werewolf_agent_prompt(self, game_state: Dict[str, Any]) -> str:
+        """构建狼人Agent提示（仅包含本回合变化的局势）"""
+        game_context = self.llm_interface.format_game_context(game_state)
+        suspicion_info = self.format_suspicions()
+        
+        prompt = self._NIGHT_PROMPT_TEMPLATE.format_map({
+            "game_context": game_context,
+            "suspicion_info": suspicion_info
+        })
         
         return prompt
     
@@ -129,15 +194,26 @@ class WerewolfAgent(BaseGameAgent):
         """解析Agent响应"""
         try:
             # 从Agent响应中提取决策信息
-            response_text = str(response)
+            response_text = extract_response_text(response)
+            
+            # 优先按JSON解析，模型未遵守格式时再用正则提取
+            decision = parse_json_decision(response_text)
+            target_id = decision.get("target_id") if decision else None
+            if isinstance(target_id, int) and not isinstance(target_id, bool):
+                return {
+                    "action": "kill",
+                    "target": target_id,
+                    "success": True,
+                    "message": f"狼人Agent选择击杀玩家{target_id}",
+                    "agent_mode": True
+                }
             
             # 查找最终决策
             if "final_decision" in response_text and "target_id" in response_text:
-                # 尝试提取目标ID
-                import re
-                target_matches = re.findall(r'target_id["\']?\s*:\s*(\d+)', response_text)
-                if target_matches:
-                    target_id = int(target_matches[0])
+                # 尝试提取目标ID（使用模块级预编译正则）
+                target_match = TARGET_ID_RE.search(response_text)
+                if target_match:
+                    target_id = int(target_match.group(1))
                     return {
                         "action": "kill",
                         "target": target_id,
@@ -155,8 +231,7 @@ class WerewolfAgent(BaseGameAgent):
     
     def _get_default_kill_decision(self, game_state: Dict[str, Any]) -> Dict[str, Any]:
         """获取默认击杀决策"""
-        alive_players = [p["id"] for p in game_state.get("alive_players", []) 
-                        if p["id"] != self.player_id and p["id"] not in self.teammates]
+        alive_players = self._non_teammate_alive_ids(game_state)
         
         if not alive_players:
             return {
@@ -177,8 +252,7 @@ class WerewolfAgent(BaseGameAgent):
                 }
         
         # 随机选择
-        import random
-        target = random.choice(alive_players)
+        target = self._rng.choice(alive_players)
         return {
             "action": "kill",
             "target": target,
@@ -189,8 +263,7 @@ class WerewolfAgent(BaseGameAgent):
     async def _basic_night_action(self, game_state: Dict[str, Any]) -> Dict[str, Any]:
         """基础夜晚行动（备用方案）"""
         try:
-            alive_players = [p["id"] for p in game_state.get("alive_players", []) 
-                           if p["id"] != self.player_id and p["id"] not in self.teammates]
+            alive_players = self._non_teammate_alive_ids(game_state)
             
             if not alive_players:
                 return {
@@ -236,56 +309,30 @@ class WerewolfAgent(BaseGameAgent):
                 return suspect
         
         # 否则随机选择
-        import random
-        return random.choice(candidates)
+        return self._rng.choice(candidates)
     
     async def make_speech(self, game_state: Dict[str, Any]) -> str:
         """狼人伪装发言（保持原有逻辑）"""
         try:
-            # 使用身份强化的提示词进行伪装
-            identity_context = self.get_identity_context()
-            enhanced_speech_prompt = self.get_enhanced_prompt("speech_prompt")
-            disguise_prompt = self.get_role_prompt("disguise_prompt")
-            
+            # 身份、伪装要求与机密信息固定不变，作为系统提示；局势与记忆作为用户提示
+            system_prompt = self._static_system_prompt("speech", self._build_speech_system_prompt)
             game_context = self.llm_interface.format_game_context(game_state)
             memory_context = self.format_memory_context()
             
             # 生成虚假怀疑来误导村民
             fake_suspicions = self._generate_fake_suspicions(game_state)
             
-            werewolf_speech_prompt = f"""
-            {identity_context}
-            
-            【严重警告】你必须完美伪装成一个真正的无辜村民！绝对禁止在发言中透露任何狼人身份信息！
-            
-            {enhanced_speech_prompt}
-            
-            【伪装要求】：
-            {disguise_prompt}
-            
-            当前游戏情况：
-            {game_context}
-            
-            你的记忆：
-            {memory_context}
-            
-            你可以表达的怀疑：
-            {fake_suspicions}
-            
-            【绝对机密信息】（绝不能在发言中提及）：
-            - 你的真实身份：狼人
-            - 你的同伴：玩家{', 玩家'.join(map(str, self.teammates))}
-            - 任何狼人相关的策略或想法
-            
-            现在，请以玩家{self.player_id}号{self.name}的身份，像一个真正的村民一样发言
-            """
+            werewolf_speech_prompt = self._SPEECH_TEMPLATE.format_map({
+                "game_context": game_context,
+                "memory_context": memory_context,
+                "fake_suspicions": fake_suspicions
+            })
             
-            enhanced_role_context = self.get_enhanced_prompt("base_prompt")
             response = await self.llm_interface.generate_response(
-                werewolf_speech_prompt, enhanced_role_context
+                werewolf_speech_prompt, self.get_role_context(), system_prompt
             )
             
-            # 应用狼人专用过滤器
+            # 应用狼人专用过滤器（元游戏内容与敏感词在同一正则中一次移除）
             filtered_response = self._filter_werewolf_speech(response)
             
             # 记录自己的发言
@@ -305,40 +352,31 @@ class WerewolfAgent(BaseGameAgent):
         """狼人投票（伪装投票，保持原有逻辑）"""
         try:
             # 移除自己和同伴
-            valid_candidates = [c for c in candidates 
-                             if c != self.player_id and c not in self.teammates]
+            valid_candidates = [c for c in candidates if not self._exclude_mask >> c & 1]
             
             if not valid_candidates:
                 # 如果只能投同伴，随机选一个
-                import random
-                return random.choice([c for c in candidates if c != self.player_id])
+                return self._rng.choice([c for c in candidates if c != self.player_id])
+            
+            if len(valid_candidates) == 1:
+                # 只剩一个非同伴目标时结果已确定，无需调用模型
+                return self._record_forced_vote(valid_candidates[0])
             
-            vote_prompt = self.get_role_prompt("vote_prompt")
+            system_prompt = self._static_system_prompt("vote", self._build_vote_system_prompt)
             game_context = self.llm_interface.format_game_context(game_state)
             fake_suspicions = self._generate_fake_suspicions(game_state)
             
             candidate_info = ", ".join([f"玩家{c}" for c in valid_candidates])
             
-            werewolf_voting_prompt = f"""
-            {vote_prompt}
-            
-            当前游戏情况：
-            {game_context}
-            
-            你的虚假怀疑（用于误导）：
-            {fake_suspicions}
-            
-            可投票的玩家：{candidate_info}
-            
-            注意：绝对不能投票给你的同伴：{self.teammates}
-            
-            选择一个村民投票，要看起来合理且无辜。优先选择对狼人威胁大的村民。
-            格式：投票给玩家X，理由：XXXX
-            """
+            werewolf_voting_prompt = self._VOTE_TEMPLATE.format_map({
+                "game_context": game_context,
+                "fake_suspicions": fake_suspicions,
+                "candidate_info": candidate_info
+            })
             
             role_context = self.get_role_prompt("base_prompt")
             response = await self.llm_interface.generate_response(
-                werewolf_voting_prompt, role_context
+                werewolf_voting_prompt, role_context, system_prompt
             )
             
             # 提取投票目标
@@ -361,27 +399,62 @@ class WerewolfAgent(BaseGameAgent):
             
         except Exception as e:
             self.logger.error(f"狼人投票时出错: {e}")
-            import random
-            return random.choice([c for c in candidates if c != self.player_id])
+            return self._rng.choice([c for c in candidates if c != self.player_id])
+    
+    def _build_speech_system_prompt(self) -> str:
+        """构建狼人伪装发言的固定系统提示"""
+        return f"""
+            {self.get_identity_context()}
+            
+            【严重警告】你必须完美伪装成一个真正的无辜村民！绝对禁止在发言中透露任何狼人身份信息！
+            
+            {self.get_enhanced_prompt("speech_prompt")}
+            
+            【伪装要求】：
+            {self.get_role_prompt("disguise_prompt")}
+            
+            【绝对机密信息】（绝不能在发言中提及）：
+            - 你的真实身份：狼人
+            - 你的同伴：玩家{', 玩家'.join(map(str, self.teammates))}
+            - 任何狼人相关的策略或想法
+            
+            现在，请以玩家{self.player_id}号{self.name}的身份，像一个真正的村民一样发言
+            """
+    
+    def _build_vote_system_prompt(self) -> str:
+        """构建狼人投票的固定系统提示"""
+        return f"""
+            {self.get_role_prompt("vote_prompt")}
+            
+            注意：绝对不能投票给你的同伴：{self.teammates}
+            
+            选择一个村民投票，要看起来合理且无辜。优先选择对狼人威胁大的村民。
+            格式：投票给玩家X，理由：XXXX
+            """
     
     def _generate_fake_suspicions(self, game_state: Dict[str, Any]) -> str:
-        """生成虚假怀疑来误导村民"""
-        alive_players = [p["id"] for p in game_state.get("alive_players", []) 
-                        if p["id"] != self.player_id and p["id"] not in self.teammates]
+        """生成虚假怀疑来误导村民，每轮只生成一次，发言与投票使用同一套说法"""
+        current_round = game_state.get("current_round")
+        cached_round, cached_text = self._round_fake_suspicions
+        if current_round is not None and cached_round == current_round:
+            return cached_text
+        
+        alive_players = self._non_teammate_alive_ids(game_state)
         
         if not alive_players:
             return "暂无明确怀疑对象"
         
         # 随机选择一些村民作为虚假怀疑目标
-        import random
-        fake_targets = random.sample(alive_players, min(2, len(alive_players)))
+        fake_targets = self._rng.sample(alive_players, min(2, len(alive_players)))
         
         fake_suspicions = []
         for target in fake_targets:
-            suspicion_level = random.choice(["轻微怀疑", "中度怀疑"])
+            suspicion_level = self._rng.choice(["轻微怀疑", "中度怀疑"])
             fake_suspicions.append(f"玩家{target}({suspicion_level})")
         
-        return "伪装怀疑: " + ", ".join(fake_suspicions)
+        text = "伪装怀疑: " + ", ".join(fake_suspicions)
+        self._round_fake_suspicions = (current_round, text)
+        return text
     
     def _choose_strategic_vote_target(self, candidates: List[int], game_state: Dict[str, Any]) -> int:
         """战略性选择投票目标"""
@@ -389,26 +462,14 @@ class WerewolfAgent(BaseGameAgent):
         # 这里可以添加更复杂的逻辑，比如分析发言内容
         
         # 简单策略：随机选择，但避开同伴
-        valid_targets = [c for c in candidates if c not in self.teammates]
-        import random
-        return random.choice(valid_targets) if valid_targets else random.choice(candidates)
+        valid_targets = [c for c in candidates if not self._exclude_mask >> c & 1]
+        return self._rng.choice(valid_targets) if valid_targets else self._rng.choice(candidates)
     
     def _filter_werewolf_speech(self, speech: str) -> str:
         """狼人发言专用过滤器"""
-        # 基础过滤
+        # 基础过滤与狼人屏蔽词合并为一次扫描
         filtered = self._filter_speech_output(speech)
         
-        # 狼人特定过滤
-        werewolf_forbidden_words = [
-            "狼人", "同伴", "队友", "击杀", "杀人", "夜晚", "伪装", "欺骗",
-            "狼群", "狼队", "狼人身份", "我是狼", "我们狼", "狼人同伴",
-            "击杀目标", "杀人计划", "伪装策略", "欺骗村民", "狼人团队"
-        ]
-        
-        for word in werewolf_forbidden_words:
-            if word in filtered:
-                filtered = filtered.replace(word, "")
-        
         # 如果过滤后内容过短，返回安全默认内容
         if len(filtered.strip()) < 10:
             return "我觉得需要更仔细地分析局势。"
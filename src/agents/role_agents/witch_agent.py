@@ -4,14 +4,50 @@
 """
 
 import logging
+import re
 from typing import Dict, Any, List, Optional
 from datetime import datetime
-from llama_index.core.agent import AgentRunner
 from llama_index.core.tools import FunctionTool
 
-from ..base_agent import BaseGameAgent
+from ..base_agent import BaseGameAgent, TARGET_ID_RE, extract_response_text, game_state_view
 from ..tools.witch_tools import WitchTools
 
+# 药剂决策关键词；目标ID从关键词所在的JSON对象开头（没有则从全文开头）查找，兼容以下写法：
+#   {"final_decision": {"action": "use_poison", "target_id": 4}}
+#   {"final_decision": {"target_id": 4, "action": "use_poison"}}
+#   Action: use_antidote\nAction Input: {"target_id": 3}
+_DECISION_ACT_RE = re.compile(r'use_antidote|use_poison|救人|毒人', re.IGNORECASE)
+_ANTIDOTE_ACTS = frozenset({"use_antidote", "救人"})
+
+# 女巫夜晚提示的固定片段，与动态内容交替拼接
+_WITCH_PROMPT_TMPL = (
+    "\n你是女巫，现在是夜晚药剂使用时间。\n\n当前游戏情况：\n",
+    "\n\n你的药剂状态：\n",
+    "\n\n",
+    "\n\n你的怀疑情况：\n",
+    "\n\n你的任务：\n"
+    "1. 分析今晚的死亡情况\n"
+    "2. 评估是否需要使用解药救人\n"
+    "3. 评估是否需要使用毒药杀人\n"
+    "4. 执行药剂使用决策\n\n"
+    "请使用提供的工具函数来完成药剂使用决策。谨慎使用药剂，每瓶药剂只能使用一次。\n",
+)
+# 药剂状态文本，以(是否有解药, 是否有毒药)为键
+_POTION_STATUS = {
+    (has_antidote, has_poison): "\n".join((
+        "🌿 解药: ✅ 可用" if has_antidote else "🌿 解药: ❌ 已使用",
+        "🧪 毒药: ✅ 可用" if has_poison else "🧪 毒药: ❌ 已使用"
+    ))
+    for has_antidote in (True, False)
+    for has_poison in (True, False)
+}
+
+# 策略提示中的药剂状态，以是否仍有药剂为下标
+_ANTIDOTE_HINTS = ("🌿 解药已用", "🌿 解药可用，谨慎使用")
+_POISON_HINTS = ("🧪 毒药已用", "🧪 毒药可用，谨慎使用")
+
+_WITCH_DEATH_TMPL = ("今晚死亡信息：\n- 死亡玩家：", "\n- 死亡原因：", "\n")
+
 
 class WitchAgent(BaseGameAgent):
     """女巫Agent类"""
@@ -23,8 +59,8 @@ class WitchAgent(BaseGameAgent):
         # 女巫特有属性
         self.has_antidote = True
         self.has_poison = True
-        self.saved_players = []
-        self.poisoned_players = []
+        self.saved_players = set()  # 救过的玩家ID
+        self.poisoned_players = set()  # 毒过的玩家ID
         self.last_night_death = None
         self.save_strategy = "conservative"  # conservative, aggressive, balanced
         self.poison_strategy = "conservative"  # conservative, aggressive, balanced
@@ -47,16 +83,6 @@ class WitchAgent(BaseGameAgent):
         except Exception as e:
             self.logger.error(f"注册女巫工具失败: {e}")
     
-    def _create_agent_runner(self) -> Optional[AgentRunner]:
-        """创建女巫Agent Runner"""
-        try:
-            # 使用父类的默认实现
-            return super()._create_agent_runner()
-            
-        except Exception as e:
-            self.logger.error(f"创建女巫Agent Runner失败: {e}")
-            return None
-    
     async def night_action(self, game_state: Dict[str, Any], death_info: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """女巫夜晚药剂行动（Agent模式）"""
         try:
@@ -70,25 +96,54 @@ class WitchAgent(BaseGameAgent):
                     "message": f"女巫{self.player_id}没有可用的药剂"
                 }
             
+            # 模型无法改变结果时直接走确定性的默认决策
+            if not self._can_llm_help(death_info):
+                action_result = self._get_default_potion_decision(game_state, death_info)
+                self.update_memory("night_actions", {
+                    "action": action_result.get("action", "unknown"),
+                    "target": action_result.get("target_id"),
+                    "player_id": self.player_id,
+                    "mode": "forced"
+                })
+                return action_result
+            
             if not self.agent_runner:
                 self.logger.warning("Agent Runner未初始化，使用基础决策")
                 return await self._basic_night_action(game_state, death_info)
             
-            # 构建Agent提示
-            agent_prompt = self._build_witch_agent_prompt(game_state, death_info)
+            # 格式化提示所需的各部分，再构建Agent提示
+            game_context = self.format_game_context(game_state)
+            potion_status = self._format_potion_status()
+            suspicion_info = self.format_suspicions()
+            
+            # 存活玩家、死亡信息、药剂状态与怀疑度都未变化时直接复用之前的决策
+            cache_key, cached = self._lookup_decision({
+                "action": "witch_night",
+                "game_state": {"alive_players": game_state.get("alive_players", [])},
+                "death_info": death_info,
+                "potion_status": potion_status,
+                "suspicions": sorted((player_id, round(suspicion, 2))
+                                     for player_id, suspicion in self.suspicions.items())
+            })
+            if cached is not None:
+                return cached
+            
+            agent_prompt = self._build_witch_agent_prompt(game_context, potion_status, 
+                                                          suspicion_info, death_info)
             
             # 使用Agent进行决策（暂时使用传统方式）
             response = await self.llm_interface.generate_response(agent_prompt)
             
             # 解析Agent响应
             action_result = self._parse_agent_response(response, game_state, death_info)
+            self._store_decision(cache_key, action_result)
             
             # 记录夜晚行动
             self.update_memory("night_actions", {
                 "action": action_result.get("action", "unknown"),
                 "target": action_result.get("target_id"),
                 "player_id": self.player_id,
-                "agent_response": str(response),
+                "agent_response": extract_response_text(response),
                 "mode": "agent"
             })
             
@@ -99,61 +154,40 @@ class WitchAgent(BaseGameAgent):
             # 回退到基础决策
             return await self._basic_night_action(game_state, death_info)
     
-    def _build_witch_agent_prompt(self, game_state: Dict[str, Any], death_info: Optional[Dict[str, Any]] = None) -> str:
+    def _build_witch_agent_prompt(self, game_context: str, potion_status: str, suspicion_info: str,
+                                  death_info: Optional[Dict[str, Any]] = None) -> str:
         """构建女巫Agent提示"""
-        game_context = self.llm_interface.format_game_context(game_state)
-        potion_status = self._format_potion_status()
-        suspicion_info = self.format_suspicions()
-        
         death_context = ""
         if death_info:
-            death_context = f"""
-            今晚死亡信息：
-            - 死亡玩家：{death_info.get('player_id', 'unknown')}
-            - 死亡原因：{death_info.get('reason', 'unknown')}
-            """
-        
-        prompt = f"""
-        你是女巫，现在是夜晚药剂使用时间。
-        
-        当前游戏情况：
-        {game_context}
-        
-        你的药剂状态：
-        {potion_status}
-        
-        {death_context}
-        
-        你的怀疑情况：
-        {suspicion_info}
-        
-        你的任务：
-        1. 分析今晚的死亡情况
-        2. 评估是否需要使用解药救人
-        3. 评估是否需要使用毒药杀人
-        4. 执行药剂使用决策
+            death_context = "".join((
+                _WITCH_DEATH_TMPL[0], str(self._death_target(death_info) or 'unknown'),
+                _WITCH_DEATH_TMPL[1], str(death_info.get('cause', death_info.get('reason', 'unknown'))),
+                _WITCH_DEATH_TMPL[2]
+            ))
         
-        请使用提供的工具函数来完成药剂使用决策。谨慎使用药剂，每瓶药剂只能使用一次。
-        """
-        
-        return prompt
+        return "".join((
+            _WITCH_PROMPT_TMPL[0], game_context,
+            _WITCH_PROMPT_TMPL[1], potion_status,
+            _WITCH_PROMPT_TMPL[2], death_context,
+            _WITCH_PROMPT_TMPL[3], suspicion_info,
+            _WITCH_PROMPT_TMPL[4]
+        ))
     
     def _parse_agent_response(self, response, game_state: Dict[str, Any], death_info: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """解析Agent响应"""
         try:
             # 从Agent响应中提取决策信息
-            response_text = str(response)
-            
-            # 查找最终决策
-            if "final_decision" in response_text and "action" in response_text:
-                # 尝试提取行动类型和目标ID
-                import re
-                
-                # 检查是否使用解药
-                if "use_antidote" in response_text.lower() or "救人" in response_text:
-                    target_matches = re.findall(r'target_id["\']?\s*:\s*(\d+)', response_text)
-                    target_id = int(target_matches[0]) if target_matches else None
-                    
+            response_text = extract_response_text(response)
+            
+            # 先找行动关键词，再从其所在的决策块中提取目标ID（键的先后顺序不限）
+            act_match = _DECISION_ACT_RE.search(response_text)
+            target_match = None
+            if act_match:
+                block_start = max(response_text.rfind("{", 0, act_match.start()), 0)
+                target_match = TARGET_ID_RE.search(response_text, block_start)
+            if target_match:
+                target_id = int(target_match.group(1))
+                if act_match.group().lower() in _ANTIDOTE_ACTS:
                     if target_id and self.has_antidote:
                         return {
                             "action": "use_antidote",
@@ -162,20 +196,14 @@ class WitchAgent(BaseGameAgent):
                             "message": f"女巫Agent选择使用解药救玩家{target_id}",
                             "agent_mode": True
                         }
-                
-                # 检查是否使用毒药
-                elif "use_poison" in response_text.lower() or "毒人" in response_text:
-                    target_matches = re.findall(r'target_id["\']?\s*:\s*(\d+)', response_text)
-                    target_id = int(target_matches[0]) if target_matches else None
-                    
-                    if target_id and self.has_poison:
-                        return {
-                            "action": "use_poison",
-                            "target_id": target_id,
-                            "success": True,
-                            "message": f"女巫Agent选择使用毒药杀玩家{target_id}",
-                            "agent_mode": True
-                        }
+                elif target_id and self.has_poison:
+                    return {
+                        "action": "use_poison",
+                        "target_id": target_id,
+                        "success": True,
+                        "message": f"女巫Agent选择使用毒药杀玩家{target_id}",
+                        "agent_mode": True
+                    }
             
             # 如果无法解析，返回默认决策
             return self._get_default_potion_decision(game_state, death_info)
@@ -189,7 +217,7 @@ class WitchAgent(BaseGameAgent):
         try:
             # 如果有死亡信息且还有解药，考虑救人
             if death_info and self.has_antidote:
-                dead_player_id = death_info.get("player_id")
+                dead_player_id = self._death_target(death_info)
                 if dead_player_id and dead_player_id not in self.saved_players:
                     # 基于策略决定是否救人
                     if self.should_save_player(dead_player_id, game_state):
@@ -263,40 +291,44 @@ class WitchAgent(BaseGameAgent):
     
     def update_state(self, action_result: Dict[str, Any]):
         """更新女巫Agent状态"""
-        try:
-            action = action_result.get("action")
-            
-            if action == "use_antidote":
-                # 更新解药状态
-                self.has_antidote = False
-                target_id = action_result.get("target_id")
-                if target_id and target_id not in self.saved_players:
-                    self.saved_players.append(target_id)
-                    
-            elif action == "use_poison":
-                # 更新毒药状态
-                self.has_poison = False
-                target_id = action_result.get("target_id")
-                if target_id and target_id not in self.poisoned_players:
-                    self.poisoned_players.append(target_id)
-            
-        except Exception as e:
-            self.logger.error(f"更新女巫状态失败: {e}")
-    
-    def _format_potion_status(self) -> str:
-        """格式化药剂状态"""
-        status = []
-        if self.has_antidote:
-            status.append("🌿 解药: ✅ 可用")
-        else:
-            status.append("🌿 解药: ❌ 已使用")
+        action = action_result.get("action")
         
-        if self.has_poison:
-            status.append("🧪 毒药: ✅ 可用")
-        else:
-            status.append("🧪 毒药: ❌ 已使用")
+        if action in ("use_antidote", "use_poison"):
+            # 药剂状态变化后，之前缓存的决策不再适用
+            self.invalidate_decision_cache()
         
-        return "\n".join(status)
+        if action == "use_antidote":
+            # 更新解药状态
+            self.has_antidote = False
+            target_id = action_result.get("target_id")
+            if target_id:
+                self.saved_players.add(target_id)
+                
+        elif action == "use_poison":
+            # 更新毒药状态
+            self.has_poison = False
+            target_id = action_result.get("target_id")
+            if target_id:
+                self.poisoned_players.add(target_id)
+    
+    def _can_llm_help(self, death_info: Optional[Dict[str, Any]]) -> bool:
+        """今晚是否存在需要模型判断的药剂选择：有人可救，或毒药可用且策略允许使用"""
+        dead_player_id = self._death_target(death_info)
+        can_save = (self.has_antidote and dead_player_id is not None 
+                    and dead_player_id not in self.saved_players)
+        can_poison = self.has_poison and self.poison_strategy != "conservative"
+        return can_save or can_poison
+    
+    @staticmethod
+    def _death_target(death_info: Optional[Dict[str, Any]]) -> Optional[int]:
+        """今晚被杀玩家ID；游戏引擎使用target键，兼容旧的player_id键"""
+        if not death_info:
+            return None
+        return death_info.get("target", death_info.get("player_id"))
+    
+    def _format_potion_status(self) -> str:
+        """格式化药剂状态（只有四种组合，直接查表）"""
+        return _POTION_STATUS[self.has_antidote, self.has_poison]
     
     # 女巫特有方法实现
     async def make_speech(self, game_state: Dict[str, Any]) -> str:
@@ -333,102 +365,83 @@ class WitchAgent(BaseGameAgent):
             self.logger.error(f"女巫投票失败: {e}")
             return candidates[0] if candidates else 0
     
+    @property
+    def save_strategy(self) -> str:
+        """救人策略：conservative, aggressive, balanced"""
+        return self._save_strategy
+    
+    @save_strategy.setter
+    def save_strategy(self, strategy: str):
+        # 策略很少变化，设置时即选定判断函数，未知策略按balanced处理
+        self._save_strategy = strategy
+        self._save_rule = {
+            "conservative": self._save_conservative,
+            "aggressive": self._save_aggressive
+        }.get(strategy, self._save_balanced)
+    
+    @property
+    def poison_strategy(self) -> str:
+        """毒人策略：conservative, aggressive, balanced"""
+        return self._poison_strategy
+    
+    @poison_strategy.setter
+    def poison_strategy(self, strategy: str):
+        self._poison_strategy = strategy
+        self._poison_rule = {
+            "conservative": self._poison_conservative,
+            "aggressive": self.is_suspicious_player
+        }.get(strategy, self.is_highly_suspicious_player)
+    
     def should_save_player(self, target_id: int, game_state: Dict[str, Any]) -> bool:
-        """判断是否应该救某个玩家"""
-        try:
-            # 如果没有解药，无法救人
-            if not self.has_antidote:
-                return False
-            
-            # 如果已经救过这个玩家，不能再救
-            if target_id in self.saved_players:
-                return False
-            
-            # 基于策略判断
-            if self.save_strategy == "conservative":
-                # 保守策略：只救自己或明显的好人
-                return target_id == self.player_id
-            elif self.save_strategy == "aggressive":
-                # 激进策略：救任何可能的好人
-                return True
-            else:  # balanced
-                # 平衡策略：救自己或信任的玩家
-                return target_id == self.player_id or self.is_trusted_player(target_id)
-                
-        except Exception as e:
-            self.logger.error(f"判断是否救人失败: {e}")
-            return False
+        """判断是否应该救某个玩家（没有解药或已救过该玩家时不能再救）"""
+        return (self.has_antidote and target_id not in self.saved_players 
+                and self._save_rule(target_id))
     
     def should_poison_player(self, target_id: int, game_state: Dict[str, Any]) -> bool:
-        """判断是否应该毒某个玩家"""
-        try:
-            # 如果没有毒药，无法毒人
-            if not self.has_poison:
-                return False
-            
-            # 如果已经毒过这个玩家，不能再毒
-            if target_id in self.poisoned_players:
-                return False
-            
-            # 基于策略判断
-            if self.poison_strategy == "conservative":
-                # 保守策略：不轻易使用毒药
-                return False
-            elif self.poison_strategy == "aggressive":
-                # 激进策略：毒杀可疑玩家
-                return self.is_suspicious_player(target_id)
-            else:  # balanced
-                # 平衡策略：毒杀高度可疑的玩家
-                return self.is_highly_suspicious_player(target_id)
-                
-        except Exception as e:
-            self.logger.error(f"判断是否毒人失败: {e}")
-            return False
+        """判断是否应该毒某个玩家（没有毒药或已毒过该玩家时不能再毒）"""
+        return (self.has_poison and target_id not in self.poisoned_players 
+                and self._poison_rule(target_id))
+    
+    def _save_conservative(self, target_id: int) -> bool:
+        """保守策略：只救自己"""
+        return target_id == self.player_id
+    
+    def _save_aggressive(self, target_id: int) -> bool:
+        """激进策略：救任何可能的好人"""
+        return True
+    
+    def _save_balanced(self, target_id: int) -> bool:
+        """平衡策略：救自己或信任的玩家"""
+        return target_id == self.player_id or self.is_trusted_player(target_id)
+    
+    def _poison_conservative(self, target_id: int) -> bool:
+        """保守策略：不轻易使用毒药"""
+        return False
     
     def get_recommended_poison_target(self, game_state: Dict[str, Any]) -> Optional[int]:
-        """获取推荐的毒杀目标"""
-        try:
-            alive_players = [p for p in game_state.get("players", []) if p.get("is_alive", True)]
-            
-            # 找出最可疑的玩家
-            most_suspicious = None
-            highest_suspicion = 0
-            
-            for player in alive_players:
-                if player["id"] == self.player_id:
-                    continue  # 不毒自己
-                
-                suspicion_level = self.get_suspicion_level(player["id"])
-                if suspicion_level > highest_suspicion:
-                    highest_suspicion = suspicion_level
-                    most_suspicious = player["id"]
-            
-            return most_suspicious
-            
-        except Exception as e:
-            self.logger.error(f"获取毒杀目标失败: {e}")
+        """获取推荐的毒杀目标：存活玩家中怀疑度最高且大于0的一位（不含自己）"""
+        suspicions = self.suspicions
+        candidates = [pid for pid in game_state_view(game_state).alive_ids 
+                      if pid != self.player_id and suspicions.get(pid, 0.0) > 0]
+        if not candidates:
             return None
+        # alive_ids按ID排序，max在并列时保留ID最小的玩家
+        return max(candidates, key=suspicions.__getitem__)
     
     def analyze_night_deaths(self, deaths: List[Dict[str, Any]]):
         """分析夜晚死亡情况"""
         try:
+            # 同一批死亡共用一个时间戳
+            timestamp = datetime.now().isoformat()
             for death in deaths:
-                player_id = death.get("player_id")
                 death_type = death.get("type", "unknown")
                 
-                if death_type == "werewolf_kill":
-                    # 狼人击杀，记录信息
-                    self.update_memory("night_deaths", {
-                        "player_id": player_id,
-                        "type": death_type,
-                        "timestamp": datetime.now().isoformat()
-                    })
-                elif death_type == "witch_poison":
-                    # 女巫毒杀，记录信息
+                # 记录狼人击杀与女巫毒杀的信息
+                if death_type in ("werewolf_kill", "witch_poison"):
                     self.update_memory("night_deaths", {
-                        "player_id": player_id,
+                        "player_id": death.get("player_id"),
                         "type": death_type,
-                        "timestamp": datetime.now().isoformat()
+                        "timestamp": timestamp
                     })
                     
         except Exception as e:
@@ -436,22 +449,8 @@ class WitchAgent(BaseGameAgent):
     
     def get_strategy_hint(self) -> str:
         """获取女巫策略提示"""
-        hints = []
-        
-        if self.has_antidote:
-            hints.append("🌿 解药可用，谨慎使用")
-        else:
-            hints.append("🌿 解药已用")
-        
-        if self.has_poison:
-            hints.append("🧪 毒药可用，谨慎使用")
-        else:
-            hints.append("🧪 毒药已用")
-        
-        hints.append(f"💡 救人策略: {self.save_strategy}")
-        hints.append(f"💡 毒人策略: {self.poison_strategy}")
-        
-        return "\n".join(hints)
+        return (f"{_ANTIDOTE_HINTS[self.has_antidote]}\n{_POISON_HINTS[self.has_poison]}\n"
+                f"💡 救人策略: {self.save_strategy}\n💡 毒人策略: {self.poison_strategy}")
     
     def is_trusted_player(self, player_id: int) -> bool:
         """判断是否为信任的玩家"""
@@ -470,12 +469,8 @@ class WitchAgent(BaseGameAgent):
         return suspicion_level > 0.8
     
     def get_suspicion_level(self, player_id: int) -> float:
-        """获取玩家可疑度"""
-        # 简化实现：基于基础可疑度计算
-        # 在实际游戏中，这应该基于记忆中的行为分析
+        """获取玩家可疑度（基于记忆分析累积的怀疑度）"""
         if player_id == self.player_id:
             return 0.0  # 自己不可疑
         
-        # 随机生成可疑度（在实际实现中应该基于记忆分析）
-        import random
-        return random.uniform(0.0, 1.0) 
\ No newline at end of file
+        return self.suspicions.get(player_id, 0.0) 
\ No newline at end of file
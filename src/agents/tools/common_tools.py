@@ -3,11 +3,23 @@
 定义所有角色都可以使用的通用工具函数
 """
 
+import heapq
 import logging
+from bisect import bisect_right
 from typing import Dict, Any, List, Optional
 from llama_index.core.tools import FunctionTool
 
 from ...ai_agent import BaseAIAgent
+from ..base_agent import game_state_view
+
+
+# 发言情感词汇
+POSITIVE_WORDS = ('相信', '信任', '无辜', '可靠', '真实', '支持')
+NEGATIVE_WORDS = ('怀疑', '可疑', '狡猾', '撒谎', '奇怪', '反对')
+
+# 怀疑度描述分档：下界升序，描述比下界多一档（低于最小下界为"高度可信"）
+SUSPICION_BOUNDS = (-0.5, -0.1, 0.3, 0.7)
+SUSPICION_LABELS = ("高度可信", "较为可信", "中性", "较为可疑", "高度可疑")
 
 
 class CommonTools:
@@ -16,46 +28,49 @@ class CommonTools:
     def __init__(self, agent: BaseAIAgent):
         self.agent = agent
         self.logger = logging.getLogger(f"CommonTools_{agent.player_id}")
+        self._tools: Optional[List[FunctionTool]] = None  # 工具签名运行期不变，首次获取时构建
     
     def get_tools(self) -> List[FunctionTool]:
         """获取所有通用工具"""
-        return [
-            FunctionTool.from_defaults(
-                fn=self.analyze_game_situation,
-                name="analyze_game_situation",
-                description="分析当前游戏局势"
-            ),
-            FunctionTool.from_defaults(
-                fn=self.get_player_info,
-                name="get_player_info",
-                description="获取玩家信息"
-            ),
-            FunctionTool.from_defaults(
-                fn=self.update_suspicion,
-                name="update_suspicion",
-                description="更新对某个玩家的怀疑度"
-            ),
-            FunctionTool.from_defaults(
-                fn=self.analyze_speech_patterns,
-                name="analyze_speech_patterns",
-                description="分析发言模式"
-            ),
-            FunctionTool.from_defaults(
-                fn=self.evaluate_voting_strategy,
-                name="evaluate_voting_strategy",
-                description="评估投票策略"
-            ),
-            FunctionTool.from_defaults(
-                fn=self.get_memory_summary,
-                name="get_memory_summary",
-                description="获取记忆摘要"
-            ),
-            FunctionTool.from_defaults(
-                fn=self.analyze_behavior_consistency,
-                name="analyze_behavior_consistency",
-                description="分析行为一致性"
-            )
-        ]
+        if self._tools is None:
+            self._tools = [
+                FunctionTool.from_defaults(
+                    fn=self.analyze_game_situation,
+                    name="analyze_game_situation",
+                    description="分析当前游戏局势"
+                ),
+                FunctionTool.from_defaults(
+                    fn=self.get_player_info,
+                    name="get_player_info",
+                    description="获取玩家信息"
+                ),
+                FunctionTool.from_defaults(
+                    fn=self.update_suspicion,
+                    name="update_suspicion",
+                    description="更新对某个玩家的怀疑度"
+                ),
+                FunctionTool.from_defaults(
+                    fn=self.analyze_speech_patterns,
+                    name="analyze_speech_patterns",
+                    description="分析发言模式"
+                ),
+                FunctionTool.from_defaults(
+                    fn=self.evaluate_voting_strategy,
+                    name="evaluate_voting_strategy",
+                    description="评估投票策略"
+                ),
+                FunctionTool.from_defaults(
+                    fn=self.get_memory_summary,
+                    name="get_memory_summary",
+                    description="获取记忆摘要"
+                ),
+                FunctionTool.from_defaults(
+                    fn=self.analyze_behavior_consistency,
+                    name="analyze_behavior_consistency",
+                    description="分析行为一致性"
+                )
+            ]
+        return self._tools
     
     def analyze_game_situation(self, game_state: Dict[str, Any]) -> Dict[str, Any]:
         """分析当前游戏局势"""
@@ -81,10 +96,9 @@ class CommonTools:
                     "has_poison": getattr(self.agent, 'has_poison', True)
                 }
             elif self.agent.role == "seer":
-                vision_results = getattr(self.agent, 'vision_results', {})
-                analysis["vision_count"] = len(vision_results)
-                analysis["known_werewolves"] = [p for p, role in vision_results.items() if role == "werewolf"]
-                analysis["known_villagers"] = [p for p, role in vision_results.items() if role == "villager"]
+                analysis["vision_count"] = len(getattr(self.agent, 'vision_results', {}))
+                analysis["known_werewolves"] = sorted(getattr(self.agent, 'known_werewolves_set', ()))
+                analysis["known_villagers"] = sorted(getattr(self.agent, 'known_villagers_set', ()))
             
             return analysis
             
@@ -99,15 +113,8 @@ class CommonTools:
     def get_player_info(self, player_id: int, game_state: Dict[str, Any]) -> Dict[str, Any]:
         """获取玩家信息"""
         try:
-            alive_players = game_state.get("alive_players", [])
-            dead_players = game_state.get("dead_players", [])
-            
-            # 查找玩家
-            player = None
-            for p in alive_players + dead_players:
-                if p["id"] == player_id:
-                    player = p
-                    break
+            # 查找玩家（按ID索引，同一份game_state只构建一次）
+            player = game_state_view(game_state).by_id.get(player_id)
             
             if not player:
                 return {
@@ -123,8 +130,8 @@ class CommonTools:
                 "action": "get_player_info",
                 "success": True,
                 "player_id": player_id,
-                "player_name": player.get("name", ""),
-                "is_alive": player_id in [p["id"] for p in alive_players],
+                "player_name": player.name,
+                "is_alive": player.is_alive,
                 "suspicion_level": suspicion,
                 "suspicion_description": self._get_suspicion_description(suspicion)
             }
@@ -172,22 +179,12 @@ class CommonTools:
     
     def _get_suspicion_description(self, suspicion: float) -> str:
         """获取怀疑度描述"""
-        if suspicion >= 0.7:
-            return "高度可疑"
-        elif suspicion >= 0.3:
-            return "较为可疑"
-        elif suspicion >= -0.1:
-            return "中性"
-        elif suspicion >= -0.5:
-            return "较为可信"
-        else:
-            return "高度可信"
+        return SUSPICION_LABELS[bisect_right(SUSPICION_BOUNDS, suspicion)]
     
     def analyze_speech_patterns(self, target_id: int) -> Dict[str, Any]:
         """分析发言模式"""
         try:
-            speeches = self.agent.game_memory.get("speeches", [])
-            target_speeches = [s for s in speeches if s.get("speaker_id") == target_id]
+            target_speeches = self.agent.get_player_events("speeches", target_id)
             
             if not target_speeches:
                 return {
@@ -198,16 +195,18 @@ class CommonTools:
             
             # 分析发言特征
             speech_count = len(target_speeches)
-            avg_length = sum(len(s.get("content", "")) for s in target_speeches) / speech_count
+            total_length = 0
+            positive_count = 0
+            negative_count = 0
             
-            # 分析情感词汇
-            positive_words = ['相信', '信任', '无辜', '可靠', '真实', '支持']
-            negative_words = ['怀疑', '可疑', '狡猾', '撒谎', '奇怪', '反对']
+            # 逐条发言只取一次内容，同时统计长度和情感词汇
+            for s in target_speeches:
+                content = s.get("content", "")
+                total_length += len(content)
+                positive_count += sum(word in content for word in POSITIVE_WORDS)
+                negative_count += sum(word in content for word in NEGATIVE_WORDS)
             
-            positive_count = sum(1 for s in target_speeches 
-                               for word in positive_words if word in s.get("content", ""))
-            negative_count = sum(1 for s in target_speeches 
-                               for word in negative_words if word in s.get("content", ""))
+            avg_length = total_length / speech_count
             
             return {
                 "action": "analyze_speech",
@@ -238,21 +237,27 @@ class CommonTools:
                     "message": "没有可投票的候选人"
                 }
             
-            # 分析每个候选人的怀疑度
-            candidate_analysis = []
-            for candidate_id in candidates:
-                if candidate_id == self.agent.player_id:
+            candidates_set = set(candidates)
+            candidates_set.discard(self.agent.player_id)
+            
+            # 沿已排好序的怀疑度列表挑出候选人；没有怀疑度记录的候选人按0.0插在非负与负值之间
+            ranked = []
+            unscored = [c for c in dict.fromkeys(candidates) if c in candidates_set and c not in self.agent.suspicions]
+            for player_id, suspicion in self.agent.get_suspicion_ranking():
+                if player_id not in candidates_set:
                     continue
-                
-                suspicion = self.agent.suspicions.get(candidate_id, 0.0)
-                candidate_analysis.append({
-                    "player_id": candidate_id,
-                    "suspicion": suspicion,
-                    "recommendation": "vote" if suspicion > 0.3 else "avoid" if suspicion < -0.3 else "neutral"
-                })
+                if unscored and suspicion < 0.0:
+                    ranked.extend((c, 0.0) for c in unscored)
+                    unscored = []
+                ranked.append((player_id, suspicion))
+            ranked.extend((c, 0.0) for c in unscored)
             
-            # 排序并推荐
-            candidate_analysis.sort(key=lambda x: x["suspicion"], reverse=True)
+            # 分析每个候选人的怀疑度
+            candidate_analysis = [{
+                "player_id": candidate_id,
+                "suspicion": suspicion,
+                "recommendation": "vote" if suspicion > 0.3 else "avoid" if suspicion < -0.3 else "neutral"
+            } for candidate_id, suspicion in ranked]
             recommended_target = candidate_analysis[0]["player_id"] if candidate_analysis else None
             
             return {
@@ -275,10 +280,12 @@ class CommonTools:
         """获取记忆摘要"""
         try:
             if memory_type == "all":
-                memories = []
-                for mem_type, mem_list in self.agent.game_memory.items():
-                    if isinstance(mem_list, list):
-                        memories.extend(mem_list[-limit:])
+                # 跨类型只保留时间戳最新的limit条，按时间先后排列
+                recent = (memory for mem_list in self.agent.game_memory.values()
+                          if isinstance(mem_list, list)
+                          for memory in mem_list[-limit:] if isinstance(memory, dict))
+                memories = heapq.nlargest(limit, recent, key=lambda m: m.get("timestamp", ""))
+                memories.reverse()
             else:
                 memories = self.agent.game_memory.get(memory_type, [])
                 if isinstance(memories, list):
@@ -290,9 +297,10 @@ class CommonTools:
             formatted_memories = []
             for memory in memories:
                 if isinstance(memory, dict):
+                    text = str(memory)
                     formatted_memories.append({
                         "type": memory.get("type", "unknown"),
-                        "content": str(memory)[:100] + "..." if len(str(memory)) > 100 else str(memory),
+                        "content": text[:100] + "..." if len(text) > 100 else text,
                         "timestamp": memory.get("timestamp", "unknown")
                     })
             
@@ -316,12 +324,10 @@ class CommonTools:
         """分析行为一致性"""
         try:
             # 分析投票一致性
-            votes = self.agent.game_memory.get("votes", [])
-            target_votes = [v for v in votes if v.get("voter_id") == target_id]
+            target_votes = self.agent.get_player_events("votes", target_id)
             
             # 分析发言一致性
-            speeches = self.agent.game_memory.get("speeches", [])
-            target_speeches = [s for s in speeches if s.get("speaker_id") == target_id]
+            target_speeches = self.agent.get_player_events("speeches", target_id)
             
             # 计算一致性指标
             vote_consistency = self._calculate_vote_consistency(target_votes)
@@ -351,10 +357,11 @@ class CommonTools:
             return 0.5  # 默认中等一致性
         
         # 分析投票目标的一致性
-        vote_targets = [v.get("target_id") for v in votes if v.get("target_id")]
-        if len(set(vote_targets)) == 1:
+        vote_targets = [target for target in (v.get("target_id") for v in votes) if target]
+        distinct_count = len(set(vote_targets))
+        if distinct_count == 1:
             return 1.0  # 完全一致
-        elif len(set(vote_targets)) == len(vote_targets):
+        elif distinct_count == len(vote_targets):
             return 0.0  # 完全不一致
         
         return 0.5  # 中等一致性
@@ -365,9 +372,16 @@ class CommonTools:
             return 0.5  # 默认中等一致性
         
         # 分析发言内容的一致性（简化版本）
-        contents = [s.get("content", "") for s in speeches]
-        avg_length = sum(len(c) for c in contents) / len(contents)
-        length_variance = sum((len(c) - avg_length) ** 2 for c in contents) / len(contents)
+        # 一次遍历累加长度和长度平方，得到均值与方差
+        count = len(speeches)
+        total = 0
+        total_sq = 0
+        for s in speeches:
+            length = len(s.get("content", ""))
+            total += length
+            total_sq += length * length
+        avg_length = total / count
+        length_variance = max(0.0, total_sq / count - avg_length * avg_length)
         
         # 长度一致性（方差越小越一致）
         consistency = max(0, 1 - length_variance / (avg_length ** 2))
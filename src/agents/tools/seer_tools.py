@@ -4,10 +4,21 @@
 """
 
 import logging
+from bisect import bisect_left
 from typing import Dict, Any, List, Optional
 from llama_index.core.tools import FunctionTool
 
 from ...ai_agent import BaseAIAgent
+from ..base_agent import game_state_view
+
+
+# 查验优先级分档：怀疑度严格大于下界才进入更高一档
+DIVINE_PRIORITY_BOUNDS = (0.2, 0.5)
+DIVINE_PRIORITIES = (
+    ("low_priority", "玩家{}可疑度较低，但仍有查验价值"),
+    ("medium_priority", "玩家{}有一定可疑度，值得查验"),
+    ("high_priority", "玩家{}高度可疑，建议优先查验"),
+)
 
 
 class SeerTools:
@@ -16,36 +27,37 @@ class SeerTools:
     def __init__(self, seer_agent: BaseAIAgent):
         self.seer = seer_agent
         self.logger = logging.getLogger(f"SeerTools_{seer_agent.player_id}")
+        self._tools: Optional[List[FunctionTool]] = None  # 工具签名运行期不变，首次获取时构建
     
     def get_tools(self) -> List[FunctionTool]:
         """获取所有预言家工具"""
-        return [
-            FunctionTool.from_defaults(
-                fn=self.analyze_suspicious_players,
-                name="analyze_suspicious_players",
-                description="分析可疑玩家，选择查验目标"
-            ),
-            FunctionTool.from_defaults(
-                fn=self.evaluate_divine_target,
-                name="evaluate_divine_target",
-                description="评估是否应该查验某个玩家"
-            ),
-            FunctionTool.from_defaults(
-                fn=self.divine_player,
-                name="divine_player",
-                description="查验指定玩家的身份"
-            )
-        ]
+        if self._tools is None:
+            self._tools = [
+                FunctionTool.from_defaults(
+                    fn=self.analyze_suspicious_players,
+                    name="analyze_suspicious_players",
+                    description="分析可疑玩家，选择查验目标"
+                ),
+                FunctionTool.from_defaults(
+                    fn=self.evaluate_divine_target,
+                    name="evaluate_divine_target",
+                    description="评估是否应该查验某个玩家"
+                ),
+                FunctionTool.from_defaults(
+                    fn=self.divine_player,
+                    name="divine_player",
+                    description="查验指定玩家的身份"
+                )
+            ]
+        return self._tools
     
     def analyze_suspicious_players(self, game_state: Dict[str, Any]) -> Dict[str, Any]:
         """分析可疑玩家"""
         try:
-            alive_players = [p["id"] for p in game_state.get("alive_players", []) 
-                           if p["id"] != self.seer.player_id]
-            
-            # 排除已经查验过的玩家
-            unverified_players = [p for p in alive_players 
-                                if p not in getattr(self.seer, 'vision_results', {})]
+            # 排除自己和已经查验过的玩家
+            vision_results = getattr(self.seer, 'vision_results', {})
+            unverified_players = [p for p in game_state_view(game_state).alive_ids
+                                if p != self.seer.player_id and p not in vision_results]
             
             if not unverified_players:
                 return {
@@ -84,10 +96,7 @@ class SeerTools:
     def evaluate_divine_target(self, target_id: int, game_state: Dict[str, Any]) -> Dict[str, Any]:
         """评估是否应该查验某个玩家"""
         try:
-            alive_players = [p["id"] for p in game_state.get("alive_players", []) 
-                           if p["id"] != self.seer.player_id]
-            
-            if target_id not in alive_players:
+            if target_id == self.seer.player_id or target_id not in game_state_view(game_state).alive_set:
                 return {
                     "action": "evaluate_divine",
                     "success": False,
@@ -104,15 +113,8 @@ class SeerTools:
             # 评估查验价值
             suspicion_level = self.seer.suspicions.get(target_id, 0.0)
             
-            if suspicion_level > 0.5:
-                recommendation = "high_priority"
-                reason = f"玩家{target_id}高度可疑，建议优先查验"
-            elif suspicion_level > 0.2:
-                recommendation = "medium_priority"
-                reason = f"玩家{target_id}有一定可疑度，值得查验"
-            else:
-                recommendation = "low_priority"
-                reason = f"玩家{target_id}可疑度较低，但仍有查验价值"
+            recommendation, reason_template = DIVINE_PRIORITIES[bisect_left(DIVINE_PRIORITY_BOUNDS, suspicion_level)]
+            reason = reason_template.format(target_id)
             
             return {
                 "action": "evaluate_divine",
@@ -8,6 +8,7 @@ from typing import Dict, Any, List, Optional
 from llama_index.core.tools import FunctionTool
 
 from ...ai_agent import BaseAIAgent
+from ..base_agent import game_state_view
 
 
 class WerewolfTools:
@@ -16,31 +17,34 @@ class WerewolfTools:
     def __init__(self, werewolf_agent: BaseAIAgent):
         self.werewolf = werewolf_agent
         self.logger = logging.getLogger(f"WerewolfTools_{werewolf_agent.player_id}")
+        self._tools: Optional[List[FunctionTool]] = None  # 工具签名运行期不变，首次获取时构建
     
     def get_tools(self) -> List[FunctionTool]:
         """获取所有狼人工具"""
-        return [
-            FunctionTool.from_defaults(
-                fn=self.coordinate_with_teammates,
-                name="coordinate_with_teammates",
-                description="与狼人同伴协调行动"
-            ),
-            FunctionTool.from_defaults(
-                fn=self.analyze_threat_level,
-                name="analyze_threat_level",
-                description="分析当前威胁等级"
-            ),
-            FunctionTool.from_defaults(
-                fn=self.select_kill_target,
-                name="select_kill_target",
-                description="选择击杀目标"
-            ),
-            FunctionTool.from_defaults(
-                fn=self.kill_player,
-                name="kill_player",
-                description="击杀指定玩家"
-            )
-        ]
+        if self._tools is None:
+            self._tools = [
+                FunctionTool.from_defaults(
+                    fn=self.coordinate_with_teammates,
+                    name="coordinate_with_teammates",
+                    description="与狼人同伴协调行动"
+                ),
+                FunctionTool.from_defaults(
+                    fn=self.analyze_threat_level,
+                    name="analyze_threat_level",
+                    description="分析当前威胁等级"
+                ),
+                FunctionTool.from_defaults(
+                    fn=self.select_kill_target,
+                    name="select_kill_target",
+                    description="选择击杀目标"
+                ),
+                FunctionTool.from_defaults(
+                    fn=self.kill_player,
+                    name="kill_player",
+                    description="击杀指定玩家"
+                )
+            ]
+        return self._tools
     
     def coordinate_with_teammates(self, teammates: List[int], game_state: Dict[str, Any]) -> Dict[str, Any]:
         """与狼人同伴协调行动"""
@@ -53,7 +57,8 @@ class WerewolfTools:
                 }
             
             # 分析同伴状态
-            alive_teammates = [t for t in teammates if t in [p["id"] for p in game_state.get("alive_players", [])]]
+            alive_set = game_state_view(game_state).alive_set
+            alive_teammates = [t for t in teammates if t in alive_set]
             
             if not alive_teammates:
                 return {
@@ -85,9 +90,9 @@ class WerewolfTools:
         """分析当前威胁等级"""
         try:
             # 分析存活的好人数量
-            alive_players = game_state.get("alive_players", [])
-            alive_good_players = [p for p in alive_players if p["id"] != self.werewolf.player_id 
-                                and p["id"] not in getattr(self.werewolf, 'teammates', [])]
+            alive_good_players = (game_state_view(game_state).alive_set
+                                  - getattr(self.werewolf, 'teammates_set', frozenset())
+                                  - {self.werewolf.player_id})
             
             # 分析威胁等级
             if len(alive_good_players) <= 2:
@@ -128,9 +133,10 @@ class WerewolfTools:
                 }
             
             # 排除自己和同伴
+            teammates_set = getattr(self.werewolf, 'teammates_set', frozenset())
             valid_targets = [c for c in candidates 
                            if c != self.werewolf.player_id 
-                           and c not in getattr(self.werewolf, 'teammates', [])]
+                           and c not in teammates_set]
             
             if not valid_targets:
                 return {
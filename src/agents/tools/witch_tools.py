@@ -16,41 +16,44 @@ class WitchTools:
     def __init__(self, witch_agent: BaseAIAgent):
         self.witch = witch_agent
         self.logger = logging.getLogger(f"WitchTools_{witch_agent.player_id}")
+        self._tools: Optional[List[FunctionTool]] = None  # 工具签名运行期不变，首次获取时构建
     
     def get_tools(self) -> List[FunctionTool]:
         """获取所有女巫工具"""
-        return [
-            FunctionTool.from_defaults(
-                fn=self.analyze_death_situation,
-                name="analyze_death_situation",
-                description="分析今晚的死亡情况，评估是否需要使用解药"
-            ),
-            FunctionTool.from_defaults(
-                fn=self.evaluate_save_target,
-                name="evaluate_save_target", 
-                description="评估是否应该救活某个玩家"
-            ),
-            FunctionTool.from_defaults(
-                fn=self.evaluate_poison_target,
-                name="evaluate_poison_target",
-                description="评估是否应该毒死某个玩家"
-            ),
-            FunctionTool.from_defaults(
-                fn=self.use_antidote,
-                name="use_antidote",
-                description="使用解药救活指定玩家"
-            ),
-            FunctionTool.from_defaults(
-                fn=self.use_poison,
-                name="use_poison", 
-                description="使用毒药毒死指定玩家"
-            ),
-            FunctionTool.from_defaults(
-                fn=self.no_action,
-                name="no_action",
-                description="不使用任何药剂"
-            )
-        ]
+        if self._tools is None:
+            self._tools = [
+                FunctionTool.from_defaults(
+                    fn=self.analyze_death_situation,
+                    name="analyze_death_situation",
+                    description="分析今晚的死亡情况，评估是否需要使用解药"
+                ),
+                FunctionTool.from_defaults(
+                    fn=self.evaluate_save_target,
+                    name="evaluate_save_target", 
+                    description="评估是否应该救活某个玩家"
+                ),
+                FunctionTool.from_defaults(
+                    fn=self.evaluate_poison_target,
+                    name="evaluate_poison_target",
+                    description="评估是否应该毒死某个玩家"
+                ),
+                FunctionTool.from_defaults(
+                    fn=self.use_antidote,
+                    name="use_antidote",
+                    description="使用解药救活指定玩家"
+                ),
+                FunctionTool.from_defaults(
+                    fn=self.use_poison,
+                    name="use_poison", 
+                    description="使用毒药毒死指定玩家"
+                ),
+                FunctionTool.from_defaults(
+                    fn=self.no_action,
+                    name="no_action",
+                    description="不使用任何药剂"
+                )
+            ]
+        return self._tools
     
     def analyze_death_situation(self, death_info: Dict[str, Any], game_state: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -208,7 +211,7 @@ class WitchTools:
             
             # 更新女巫状态
             self.witch.has_antidote = False
-            self.witch.saved_players.append(target_id)
+            self.witch.saved_players.add(target_id)
             
             self.logger.info(f"女巫{self.witch.player_id}使用解药救活玩家{target_id}")
             
@@ -255,7 +258,7 @@ class WitchTools:
             
             # 更新女巫状态
             self.witch.has_poison = False
-            self.witch.poisoned_players.append(target_id)
+            self.witch.poisoned_players.add(target_id)
             
             self.logger.info(f"女巫{self.witch.player_id}使用毒药毒死玩家{target_id}")
             
@@ -3,20 +3,50 @@ AI智能体基类模块
 定义狼人杀游戏中所有AI角色的基础行为和接口
 """
 
+import re
 import json
+import heapq
 import asyncio
 import logging
 from abc import ABC, abstractmethod
-from typing import Dict, Any, List, Optional
+from operator import itemgetter
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime
 
 from .llm_interface import LLMInterface
 from .identity_system import IdentitySystem
 
+# 发言中需要移除的元游戏内容（分析标记、括号内的分析/策略说明、身份相关措辞）
+SPEECH_META_PATTERNS = (
+    r'\*\*[^*]*\*\*',            # **标记内容
+    r'\([^)]*分析[^)]*\)',         # 包含"分析"的括号内容
+    r'（[^）]*分析[^）]*）',          # 包含"分析"的中文括号内容
+    r'\([^)]*策略[^)]*\)',         # 包含"策略"的括号内容
+    r'（[^）]*策略[^）]*）',          # 包含"策略"的中文括号内容
+    "作为.*?角色", "我的身份是", "真实身份", "角色扮演",
+    "元游戏", "游戏策略", "AI分析", "系统提示",
+)
+
+# 需要按玩家建立索引的记忆类型 -> 事件中的玩家ID字段
+MEMORY_INDEX_FIELDS = {
+    "speeches": "speaker_id",
+    "votes": "voter_id",
+}
+
+
+def compile_speech_filter(extra_words=()) -> "re.Pattern[str]":
+    """将元游戏规则与角色屏蔽词合并为单个正则，一次扫描完成全部过滤（屏蔽词长词优先）"""
+    ordered = sorted(set(extra_words), key=lambda word: (-len(word), word))
+    alternatives = list(SPEECH_META_PATTERNS) + [re.escape(word) for word in ordered]
+    return re.compile("|".join(f"(?:{alt})" for alt in alternatives), re.IGNORECASE)
+
 
 class BaseAIAgent(ABC):
     """AI智能体基类，所有角色都继承此类"""
     
+    # 发言过滤正则，角色子类可替换为合并了自身屏蔽词的版本
+    _speech_filter_re = compile_speech_filter()
+    
     def __init__(self, player_id: int, name: str, role: str, 
                  llm_interface: LLMInterface, prompts: Dict[str, Any], 
                  identity_system: Optional[IdentitySystem] = None,
@@ -56,6 +86,10 @@ class BaseAIAgent(ABC):
             "night_discussions": [],  # 新增：夜晚讨论记忆
             "night_thinking": []     # 新增：夜晚思考记忆
         }
+        # 按玩家索引的记忆 {事件类型: {玩家ID: [事件, ...]}}，与game_memory同步追加和淘汰
+        self._memory_by_player: Dict[str, Dict[int, List[Dict[str, Any]]]] = {
+            event_type: {} for event_type in MEMORY_INDEX_FIELDS
+        }
         
         # 记忆配置
         memory_config = memory_config or {}
@@ -74,6 +108,7 @@ class BaseAIAgent(ABC):
         # 角色特定信息
         self.role_info = {}
         self.suspicions = {}  # 对其他玩家的怀疑度
+        self._suspicion_ranking: Optional[List[Tuple[int, float]]] = None  # 按怀疑度降序的(玩家ID, 怀疑度)，怀疑度变化时失效
         
         # 设置日志
         self.logger = logging.getLogger(f"{self.__class__.__name__}_{player_id}")
@@ -134,6 +169,9 @@ class BaseAIAgent(ABC):
         
         if event_type in self.game_memory:
             self.game_memory[event_type].append(event_data)
+            index_field = MEMORY_INDEX_FIELDS.get(event_type)
+            if index_field is not None:
+                self._memory_by_player[event_type].setdefault(event_data.get(index_field), []).append(event_data)
             
             # 根据记忆类型使用不同的限制
             if event_type == "night_discussions":
@@ -144,7 +182,28 @@ class BaseAIAgent(ABC):
                 memory_limit = getattr(self, 'max_memory_events', 50)
             
             if len(self.game_memory[event_type]) > memory_limit:
-                self.game_memory[event_type] = self.game_memory[event_type][-memory_limit:]
+                events = self.game_memory[event_type]
+                if index_field is not None:
+                    # 被淘汰的总是各玩家最早的事件，从索引头部移除
+                    index = self._memory_by_player[event_type]
+                    for evicted in events[:-memory_limit]:
+                        player_events = index.get(evicted.get(index_field))
+                        if player_events and player_events[0] is evicted:
+                            del player_events[0]
+                self.game_memory[event_type] = events[-memory_limit:]
+    
+    def get_player_events(self, event_type: str, player_id: int) -> List[Dict[str, Any]]:
+        """
+        获取某个玩家的记忆事件（仅支持MEMORY_INDEX_FIELDS中的类型）
+        
+        Args:
+            event_type: 事件类型 (speeches, votes)
+            player_id: 发言者/投票者ID
+            
+        Returns:
+            按时间先后排列的事件列表
+        """
+        return self._memory_by_player[event_type].get(player_id, [])
     
     def update_night_discussion_memory(self, discussion_data: Dict[str, Any]):
         """
@@ -204,6 +263,7 @@ class BaseAIAgent(ABC):
         current_suspicion = self.suspicions.get(target_id, 0.0)
         new_suspicion = max(-1.0, min(1.0, current_suspicion + suspicion_change))
         self.suspicions[target_id] = new_suspicion
+        self._suspicion_ranking = None
         
         self.logger.debug(f"更新对玩家{target_id}的怀疑度: {current_suspicion:.2f} -> {new_suspicion:.2f} ({reason})")
     
@@ -417,7 +477,6 @@ class BaseAIAgent(ABC):
             )
             
             # 解析回复
-            import re
             suspicion_match = re.search(r'怀疑度变化:([-+]?\d*\.?\d+)', response)
             analysis_match = re.search(r'分析:(.+)', response)
             
@@ -450,14 +509,21 @@ class BaseAIAgent(ABC):
         Returns:
             按怀疑度排序的玩家ID列表
         """
-        sorted_suspicions = sorted(self.suspicions.items(), 
-                                 key=lambda x: x[1], reverse=True)
+        # 取缓存排序结果的前count名（怀疑度更新前重复调用无需重新排序），再过滤掉怀疑度太低的
+        top_suspicions = self.get_suspicion_ranking()[:count]
         
-        # 过滤掉怀疑度太低的
-        suspicious_players = [player_id for player_id, suspicion in sorted_suspicions 
-                            if suspicion > 0.1]
+        return [player_id for player_id, suspicion in top_suspicions 
+                if suspicion > 0.1]
+    
+    def get_suspicion_ranking(self) -> List[Tuple[int, float]]:
+        """
+        获取按怀疑度从高到低排列的(玩家ID, 怀疑度)列表
         
-        return suspicious_players[:count]
+        怀疑度更新前重复调用直接复用上次的排序结果
+        """
+        if self._suspicion_ranking is None:
+            self._suspicion_ranking = sorted(self.suspicions.items(), key=itemgetter(1), reverse=True)
+        return self._suspicion_ranking
     
     def get_least_suspicious_players(self, count: int = 3) -> List[int]:
         """
@@ -469,14 +535,11 @@ class BaseAIAgent(ABC):
         Returns:
             按怀疑度排序的玩家ID列表（最低的在前）
         """
-        sorted_suspicions = sorted(self.suspicions.items(), 
-                                 key=lambda x: x[1])
-        
-        # 过滤掉怀疑度太高的
-        trustworthy_players = [player_id for player_id, suspicion in sorted_suspicions 
-                             if suspicion < 0.5]
+        # 先过滤掉怀疑度太高的，再只取最低的count名做部分排序
+        trustworthy = ((player_id, suspicion) for player_id, suspicion in self.suspicions.items()
+                       if suspicion < 0.5)
         
-        return trustworthy_players[:count]
+        return [player_id for player_id, _ in heapq.nsmallest(count, trustworthy, key=itemgetter(1))]
     
     def die(self, cause: str = "未知"):
         """
@@ -551,24 +614,8 @@ class BaseAIAgent(ABC):
             过滤后的发言内容
         """
         try:
-            # 移除常见的元游戏内容和分析标记
-            import re
-            
-            # 移除分析标记和括号内容
-            speech = re.sub(r'\*\*[^*]*\*\*', '', speech)  # 移除**标记内容
-            speech = re.sub(r'\([^)]*分析[^)]*\)', '', speech)  # 移除包含"分析"的括号内容
-            speech = re.sub(r'（[^）]*分析[^）]*）', '', speech)  # 移除包含"分析"的中文括号内容
-            speech = re.sub(r'\([^)]*策略[^)]*\)', '', speech)  # 移除包含"策略"的括号内容
-            speech = re.sub(r'（[^）]*策略[^）]*）', '', speech)  # 移除包含"策略"的中文括号内容
-            
-            # 移除常见的元游戏词汇
-            dangerous_phrases = [
-                "作为.*?角色", "我的身份是", "真实身份", "角色扮演", 
-                "元游戏", "游戏策略", "AI分析", "系统提示"
-            ]
-            
-            for phrase in dangerous_phrases:
-                speech = re.sub(phrase, '', speech, flags=re.IGNORECASE)
+            # 单次扫描移除元游戏内容、分析标记及角色屏蔽词
+            speech = self._speech_filter_re.sub('', speech)
             
             # 清理多余的空格和标点
             speech = ' '.join(speech.split())
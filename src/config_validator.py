@@ -8,6 +8,13 @@ import logging
 from pathlib import Path
 from typing import Dict, Any, Optional, List
 
+# 可选使用orjson加速JSON解析，未安装时回退到标准库
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
 
 class ConfigValidator:
     """配置验证和加载工具"""
@@ -32,8 +39,8 @@ class ConfigValidator:
         try:
             # 尝试加载配置文件
             if Path(self.config_path).exists():
-                with open(self.config_path, 'r', encoding='utf-8') as f:
-                    config = json.load(f)
+                with open(self.config_path, 'rb') as f:
+                    config = _loads(f.read())
                 self.logger.info(f"成功加载配置文件: {self.config_path}")
             else:
                 self.logger.warning(f"配置文件不存在: {self.config_path}，使用默认配置")
@@ -69,7 +76,10 @@ class ConfigValidator:
             "max_tokens": ai_settings.get("max_tokens", default_config["ai_settings"]["max_tokens"]),
             "thinking_mode": ai_settings.get("thinking_mode", default_config["ai_settings"]["thinking_mode"]),
             "context_length": ai_settings.get("context_length", default_config["ai_settings"]["context_length"]),
-            "presence_penalty": ai_settings.get("presence_penalty", default_config["ai_settings"]["presence_penalty"])
+            "presence_penalty": ai_settings.get("presence_penalty", default_config["ai_settings"]["presence_penalty"]),
+            "keep_alive": ai_settings.get("keep_alive", default_config["ai_settings"]["keep_alive"]),
+            "response_cache_size": ai_settings.get("response_cache_size", default_config["ai_settings"]["response_cache_size"]),
+            "max_concurrent_requests": ai_settings.get("max_concurrent_requests", default_config["ai_settings"]["max_concurrent_requests"])
         }
         
         # 验证和合并游戏设置
@@ -129,7 +139,10 @@ class ConfigValidator:
                 "max_tokens": 800,
                 "thinking_mode": True,
                 "context_length": 4096,
-                "presence_penalty": 1.5
+                "presence_penalty": 1.5,
+                "keep_alive": "30m",
+                "response_cache_size": 64,
+                "max_concurrent_requests": 4
             },
             "game_settings": {
                 "total_players": 7,
@@ -104,6 +104,7 @@ class WerewolfGameEngine:
                 
                 # 推进游戏阶段
                 current_phase = self.game_state.advance_phase()
+                self._notify_phase_start(current_phase)
                 
                 # 执行对应阶段逻辑
                 if current_phase == GamePhase.NIGHT:
@@ -166,6 +167,13 @@ class WerewolfGameEngine:
                 if player.role in self.special_roles:
                     self.special_roles[player.role] = player
     
+    def _notify_phase_start(self, phase) -> None:
+        """通知所有玩家进入新阶段，以便清理阶段内缓存"""
+        phase_id = (self.game_state.current_round, phase)
+        for player in self.players:
+            if hasattr(player, "begin_phase"):
+                player.begin_phase(phase_id)
+    
     async def _run_night_phase(self) -> None:
         """执行夜晚阶段"""
         round_num = self.game_state.current_round
@@ -4,23 +4,55 @@
 支持thinking/non-thinking模式切换，专为狼人杀游戏优化
 """
 
+import re
 import json
 import asyncio
+import hashlib
 import logging
-from typing import Dict, Any, Optional, List
+import threading
+from typing import Dict, Any, Optional, List, AsyncIterator
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from collections import OrderedDict
 from datetime import datetime
 
+# 共享连接池大小，与同时进行的LLM请求数量相匹配
+HTTP_POOL_SIZE = 16
+# 建立连接失败时的重试次数（仅重试连接阶段，已发出的生成请求不会重复提交）
+HTTP_CONNECT_RETRIES = 2
+
+# 回复中提到的玩家编号
+_PLAYER_ID_RE = re.compile(r'玩家(\d+)')
+
+
+def resolve_model_tag(model_name: str) -> str:
+    """补全模型标签：未写标签时Ollama使用latest"""
+    return model_name if ":" in model_name else f"{model_name}:latest"
+
+
+def create_http_session(pool_size: int = HTTP_POOL_SIZE,
+                        connect_retries: int = HTTP_CONNECT_RETRIES) -> requests.Session:
+    """创建复用TCP连接（keep-alive）的HTTP会话，连接瞬时失败时自动重试"""
+    session = requests.Session()
+    retry = Retry(total=connect_retries, connect=connect_retries, read=0, status=0,
+                  redirect=0, backoff_factor=0.2)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
 
 class LLMInterface:
     """通用LLM模型接口封装类，支持thinking模式的智能推理"""
     
-    def __init__(self, config: Dict[str, Any]):
+    def __init__(self, config: Dict[str, Any], session: Optional[requests.Session] = None):
         """
         初始化Qwen3接口
         
         Args:
             config: 配置字典，包含AI设置
+            session: 共享的HTTP会话（None时自行创建）
         """
         self.config = config
         self.ai_settings = config.get("ai_settings", {})
@@ -30,6 +62,16 @@ class LLMInterface:
         self.max_tokens = self.ai_settings.get("max_tokens", 800)
         self.thinking_mode = self.ai_settings.get("thinking_mode", True)
         self.presence_penalty = self.ai_settings.get("presence_penalty", 1.5)
+        self.keep_alive = self.ai_settings.get("keep_alive", "30m")
+        self.session = session or create_http_session()
+        
+        # 回复缓存（仅对显式请求缓存的调用生效）
+        self.response_cache_size = self.ai_settings.get("response_cache_size", 64)
+        self._response_cache: "OrderedDict[bytes, str]" = OrderedDict()
+        
+        # 限制同时发往Ollama的请求数，避免并发的Agent调用压垮服务器
+        self.max_concurrent_requests = self.ai_settings.get("max_concurrent_requests", 4)
+        self._request_slots = asyncio.Semaphore(self.max_concurrent_requests)
         
         # 设置日志
         logging.basicConfig(level=logging.INFO)
@@ -41,11 +83,11 @@ class LLMInterface:
     def _verify_connection(self) -> bool:
         """验证与Ollama服务器的连接"""
         try:
-            response = requests.get(f"{self.base_url}/api/tags", timeout=5)
+            response = self.session.get(f"{self.base_url}/api/tags", timeout=5)
             if response.status_code == 200:
                 models = response.json().get("models", [])
                 model_names = [model.get("name", "") for model in models]
-                if any(self.model_name in name for name in model_names):
+                if resolve_model_tag(self.model_name) in model_names:
                     self.logger.info(f"成功连接到Ollama，模型 {self.model_name} 可用")
                     return True
                 else:
@@ -58,8 +100,29 @@ class LLMInterface:
             self.logger.error(f"连接Ollama失败: {e}")
             return False
     
+    async def warm_up(self) -> bool:
+        """
+        预加载模型并刷新keep_alive时长，不生成任何内容
+        
+        Returns:
+            是否预加载成功
+        """
+        payload = {"model": self.model_name, "prompt": "", "keep_alive": self.keep_alive}
+        try:
+            response = await asyncio.to_thread(
+                self.session.post, f"{self.base_url}/api/generate", json=payload, timeout=120
+            )
+            if response.status_code == 200:
+                return True
+            self.logger.warning(f"模型预加载失败: {response.status_code}")
+            return False
+        except requests.exceptions.RequestException as e:
+            self.logger.warning(f"模型预加载失败: {e}")
+            return False
+    
     async def generate_response(self, prompt: str, role_context: str = "", 
-                              system_prompt: str = "", use_thinking: Optional[bool] = None) -> str:
+                              system_prompt: str = "", use_thinking: Optional[bool] = None,
+                              use_cache: bool = False, json_mode: bool = False) -> str:
         """
         生成AI回复
         
@@ -68,6 +131,8 @@ class LLMInterface:
             role_context: 角色上下文信息
             system_prompt: 系统提示词
             use_thinking: 是否使用思考模式（None时使用默认设置）
+            use_cache: 是否复用相同提示的历史回复
+            json_mode: 是否要求模型只输出JSON（Ollama的format=json）
             
         Returns:
             AI生成的回复文本
@@ -79,23 +144,23 @@ class LLMInterface:
             # 构建完整的提示
             full_prompt = self._build_full_prompt(prompt, role_context, system_prompt, thinking_enabled)
             
+            cache_key = self._response_cache_key(full_prompt, thinking_enabled, json_mode)
+            if use_cache:
+                cached = self._get_cached_response(cache_key)
+                if cached is not None:
+                    return cached
+            
             # 调用Ollama API
-            payload = {
-                "model": self.model_name,
-                "prompt": full_prompt,
-                "stream": False,
-                "options": {
-                    "temperature": self.temperature,
-                    "num_predict": self.max_tokens,
-                    "presence_penalty": self.presence_penalty
-                }
-            }
+            payload = self._build_payload(full_prompt, stream=False, json_mode=json_mode)
             
-            response = requests.post(
-                f"{self.base_url}/api/generate",
-                json=payload,
-                timeout=60
-            )
+            # 阻塞请求放到线程中执行，使多个并发调用能够真正重叠
+            async with self._request_slots:
+                response = await asyncio.to_thread(
+                    self.session.post,
+                    f"{self.base_url}/api/generate",
+                    json=payload,
+                    timeout=60
+                )
             
             if response.status_code == 200:
                 result = response.json()
@@ -103,7 +168,10 @@ class LLMInterface:
                 
                 # 如果启用thinking模式，提取最终回复部分
                 if thinking_enabled and "<think>" in raw_response:
-                    return self._extract_final_response(raw_response)
+                    raw_response = self._extract_final_response(raw_response)
+                
+                if use_cache:
+                    self._cache_response(cache_key, raw_response)
                 
                 return raw_response
             else:
@@ -114,6 +182,150 @@ class LLMInterface:
             self.logger.error(f"生成回复时出错: {e}")
             return "抱歉，生成回复时出现错误。"
     
+    async def stream_response(self, prompt: str, role_context: str = "", 
+                            system_prompt: str = "", use_thinking: Optional[bool] = None,
+                            use_cache: bool = False) -> AsyncIterator[str]:
+        """
+        流式生成AI回复，逐段产出文本；thinking模式下跳过<think>部分
+        
+        Args:
+            与generate_response相同
+            
+        Yields:
+            AI回复的文本片段
+        """
+        thinking_enabled = use_thinking if use_thinking is not None else self.thinking_mode
+        full_prompt = self._build_full_prompt(prompt, role_context, system_prompt, thinking_enabled)
+        
+        cache_key = self._response_cache_key(full_prompt, thinking_enabled)
+        if use_cache:
+            cached = self._get_cached_response(cache_key)
+            if cached is not None:
+                yield cached
+                return
+        
+        payload = self._build_payload(full_prompt, stream=True)
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
+        stop = threading.Event()
+        
+        def produce() -> None:
+            # 在线程中读取NDJSON流，将片段转交给事件循环；
+            # 调用方提前结束时关闭连接，让服务器停止继续生成
+            try:
+                with self.session.post(f"{self.base_url}/api/generate", json=payload,
+                                       stream=True, timeout=60) as response:
+                    response.raise_for_status()
+                    for line in response.iter_lines():
+                        if stop.is_set():
+                            break
+                        if not line:
+                            continue
+                        data = json.loads(line)
+                        chunk = data.get("response", "")
+                        if chunk:
+                            loop.call_soon_threadsafe(queue.put_nowait, chunk)
+                        if data.get("done"):
+                            break
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+        
+        await self._request_slots.acquire()
+        producer = asyncio.ensure_future(asyncio.to_thread(produce))
+        producer.add_done_callback(lambda _: self._request_slots.release())
+        
+        parts = []
+        pending = ""
+        passthrough = not thinking_enabled
+        
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    self.logger.error(f"流式生成回复时出错: {item}")
+                    continue
+            
+                if passthrough:
+                    parts.append(item)
+                    yield item
+                    continue
+            
+                # thinking模式：缓冲到</think>之后再输出；若未以<think>开头则直接输出
+                pending += item
+                stripped = pending.lstrip()
+                if "</think>" in pending:
+                    pending = pending.split("</think>", 1)[1].lstrip()
+                    passthrough = True
+                elif stripped and not (stripped.startswith("<think>") or "<think>".startswith(stripped)):
+                    passthrough = True
+            
+                if passthrough and pending:
+                    parts.append(pending)
+                    yield pending
+                    pending = ""
+            
+            await producer
+            
+            if pending:
+                # 未出现</think>结束标签时，与generate_response一样返回原始内容
+                parts.append(pending)
+                yield pending
+            
+            if not parts:
+                yield "抱歉，生成回复时出现错误。"
+            elif use_cache:
+                self._cache_response(cache_key, "".join(parts).strip())
+        finally:
+            stop.set()
+    
+    def _build_payload(self, full_prompt: str, stream: bool, json_mode: bool = False) -> Dict[str, Any]:
+        """构建Ollama生成请求的负载"""
+        payload = {
+            "model": self.model_name,
+            "prompt": full_prompt,
+            "stream": stream,
+            "keep_alive": self.keep_alive,
+            "options": {
+                "temperature": self.temperature,
+                "num_predict": self.max_tokens,
+                "presence_penalty": self.presence_penalty
+            }
+        }
+        if json_mode:
+            payload["format"] = "json"
+        return payload
+    
+    @staticmethod
+    def _response_cache_key(full_prompt: str, thinking_enabled: bool, json_mode: bool = False) -> bytes:
+        """回复缓存键：完整提示（含系统提示与角色背景）的blake2b摘要，避免长提示常驻内存"""
+        digest = hashlib.blake2b(full_prompt.encode(), digest_size=16)
+        digest.update(b"1" if thinking_enabled else b"0")
+        digest.update(b"j" if json_mode else b"t")
+        return digest.digest()
+    
+    def _get_cached_response(self, cache_key: bytes) -> Optional[str]:
+        """读取回复缓存，命中时刷新其最近使用位置"""
+        if self.response_cache_size <= 0:
+            return None
+        cached = self._response_cache.get(cache_key)
+        if cached is not None:
+            self._response_cache.move_to_end(cache_key)
+        return cached
+    
+    def _cache_response(self, cache_key: bytes, response: str) -> None:
+        """写入回复缓存，超出容量时淘汰最久未使用的条目"""
+        if self.response_cache_size <= 0:
+            return
+        self._response_cache[cache_key] = response
+        self._response_cache.move_to_end(cache_key)
+        while len(self._response_cache) > self.response_cache_size:
+            self._response_cache.popitem(last=False)
+    
     def _build_full_prompt(self, prompt: str, role_context: str, system_prompt: str, thinking_enabled: bool) -> str:
         """构建完整的提示词，支持thinking模式"""
         parts = []
@@ -221,10 +433,9 @@ class LLMInterface:
         
         # 提取目标玩家ID（如果有）
         if result["valid"]:
-            import re
-            player_matches = re.findall(r'玩家(\d+)', response)
-            if player_matches:
-                result["target"] = int(player_matches[0])
+            player_match = _PLAYER_ID_RE.search(response)
+            if player_match:
+                result["target"] = int(player_match.group(1))
         
         # 提取原因
         result["reason"] = response.strip()
@@ -242,13 +453,9 @@ class LLMInterface:
         Returns:
             选择的玩家ID，如果无法解析则返回None
         """
-        import re
-        
-        # 提取所有提到的玩家ID
-        player_matches = re.findall(r'玩家(\d+)', response)
-        
-        for player_str in player_matches:
-            player_id = int(player_str)
+        # 按出现顺序检查提到的玩家ID，找到第一个候选人即停止
+        for player_match in _PLAYER_ID_RE.finditer(response):
+            player_id = int(player_match.group(1))
             if player_id in candidate_players:
                 return player_id
         
@@ -169,7 +169,6 @@ class WerewolfGame:
     async def _create_players(self) -> None:
         """创建AI玩家"""
         role_counts = self.config.get("game_settings", {}).get("roles", {})
-        player_id = 1
         
         # 创建角色列表
         role_list = []
@@ -197,20 +196,19 @@ class WerewolfGame:
         # 创建Agent工厂
         agent_factory = AgentFactory(self.config)
         
-        # 创建玩家
-        for role in role_list:
-            # 统一命名为"玩家N"，确保AI之间无法通过名称识别角色身份
-            # 身份隐藏仅针对AI，用户界面会显示完整信息供观察
-            player_name = f"玩家{player_id}"
-            
-            # 使用Agent工厂创建对应的AI代理
-            player = agent_factory.create_agent(
-                player_id, player_name, role, self.llm_interface, 
-                self.role_prompts, identity_system, memory_config
-            )
-            
-            self.players.append(player)
-            player_id += 1
+        # 统一命名为"玩家N"，确保AI之间无法通过名称识别角色身份
+        # 身份隐藏仅针对AI，用户界面会显示完整信息供观察
+        player_configs = [
+            {"id": player_id, "name": f"玩家{player_id}", "role": role}
+            for player_id, role in enumerate(role_list, start=1)
+        ]
+        
+        # 使用Agent工厂并发创建对应的AI代理
+        players = await agent_factory.acreate_players(
+            player_configs, self.llm_interface, 
+            self.role_prompts, identity_system, memory_config
+        )
+        self.players.extend(players)
         
         self.logger.info(f"创建了{len(self.players)}个AI玩家")
     